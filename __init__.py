@@ -17,10 +17,13 @@ You should have received a copy of the GNU General Public License
 along with dmf_control_board.  If not, see <http://www.gnu.org/licenses/>.
 """
 from copy import deepcopy
+from functools import partial, wraps
 import logging
 import json
 import math
 import re
+import threading
+import time
 import warnings
 
 from datetime import datetime
@@ -47,20 +50,25 @@ from path_helpers import path
 from pygtkhelpers.gthreads import gtk_threadsafe
 from pygtkhelpers.ui.dialogs import info as info_dialog
 from zmq_plugin.plugin import Plugin as ZmqPlugin
-from zmq_plugin.schema import decode_content_data
-import arrow
+from zmq_plugin.schema import (decode_content_data, encode_content_data,
+                               get_header)
 import dmf_control_board_firmware as dmf
 import gobject
 import gtk
 import microdrop_utility as utility
 import numpy as np
 import pandas as pd
-import tables
 import yaml
 import zmq
 
-from ._version import get_versions
-from .wizards import MicrodropChannelsAssistantView
+from ._version_cache import get_versions
+from .hardware import (AmplifierGainCache, ChannelStates, ChannelWriteCache,
+                       ControlBoardProxy, DeviceInfo,
+                       HardwareRequestCancelled, HardwareWorker,
+                       WaveformState, gtk_wait, probe_ports)
+from .results_store import (DerivedQuantityCache, FeedbackResultsRef,
+                            HdfFeedbackResultsStore, NpyFeedbackResultsStore,
+                            bind_feedback_results, load_feedback_results)
 
 __version__ = get_versions()['version']
 del get_versions
@@ -69,8 +77,11 @@ logger = logging.getLogger(__name__)
 
 # Ignore natural name warnings from PyTables [1].
 #
+# Match warning by message (rather than by `tables.NaturalNameWarning`
+# category) to avoid importing PyTables until it is actually used.
+#
 # [1]: https://www.mail-archive.com/pytables-users@lists.sourceforge.net/msg01130.html
-warnings.simplefilter('ignore', tables.NaturalNameWarning)
+warnings.filterwarnings('ignore', message='object name ', module='tables')
 
 PluginGlobals.push_env('microdrop.managed')
 
@@ -82,20 +93,81 @@ class DmfZmqPlugin(ZmqPlugin):
     def __init__(self, parent, *args, **kwargs):
         self.parent = parent
         self._electrode_commands_registered = 0
+        # Maximum number of messages to process and maximum time (in seconds)
+        # to spend processing messages during a single call to
+        # `check_sockets`.
+        self.max_batch_messages = kwargs.pop('max_batch_messages', 100)
+        self.max_batch_duration_s = kwargs.pop('max_batch_duration_s', .02)
+        # Channel states update coalesced from electrode controller replies
+        # (see `_queue_channel_states`).
+        self._channel_states_update = None
+        self._idle_drain_id = None
+        # Asynchronous requests, indexed by request id (see
+        # `_execute_async`).
+        self._async_requests = {}
+        # Stop events of streaming channel sweeps, indexed by request id.
+        self._sweep_stop_events = {}
+        # Messages were left unprocessed while the parent plugin was waiting
+        # for a hardware request (see `_defer_sockets`).
+        self._sockets_deferred = False
         super(DmfZmqPlugin, self).__init__(*args, **kwargs)
 
     def check_sockets(self):
         '''
         Check for messages on command and subscription sockets and process
         any messages accordingly.
+
+        .. versionchanged:: 2.4.0
+            Process *all* pending messages, up to a budget of
+            :attr:`max_batch_messages` messages and :attr:`max_batch_duration_s`
+            seconds per call.  Electrode state replies received within a call
+            are coalesced into a single channel states update.
+
+        .. versionchanged:: 2.4.0
+            Defer processing while the parent plugin is waiting for a hardware
+            request (see :meth:`_defer_sockets`).
+        '''
+        if self._defer_sockets():
+            return True
+        start_time = time.time()
+        for i in xrange(self.max_batch_messages):
+            if time.time() - start_time > self.max_batch_duration_s:
+                break
+            command_received = self._recv_command()
+            subscription_received = self._recv_subscription()
+            if not (command_received or subscription_received):
+                break
+        self._flush_channel_states()
+        return True
+
+    def _recv_command(self):
+        '''
+        Process a single message from the command socket (if available).
+
+        Returns
+        -------
+        bool
+            ``True`` if a message was received.
         '''
         try:
             msg_frames = self.command_socket.recv_multipart(zmq.NOBLOCK)
         except zmq.Again:
-            pass
-        else:
-            self.on_command_recv(msg_frames)
+            return False
+        # Apply any outstanding channel states update, since the command may
+        # depend on the current channel states.
+        self._flush_channel_states()
+        self.on_command_recv(msg_frames)
+        return True
+
+    def _recv_subscription(self):
+        '''
+        Process a single message from the subscription socket (if available).
 
+        Returns
+        -------
+        bool
+            ``True`` if a message was received.
+        '''
         try:
             msg_frames = self.subscribe_socket.recv_multipart(zmq.NOBLOCK)
             source, target, msg_type, msg_json = msg_frames
@@ -107,14 +179,13 @@ class DmfZmqPlugin(ZmqPlugin):
                 if msg['content']['command'] in ('set_electrode_state',
                                                  'set_electrode_states'):
                     data = decode_content_data(msg)
-                    self.parent.actuated_area = data['actuated_area']
-                    self.parent.update_channel_states(data['channel_states'])
+                    self._queue_channel_states(data['actuated_area'],
+                                               data['channel_states'])
                 elif msg['content']['command'] == 'get_channel_states':
                     data = decode_content_data(msg)
-                    self.parent.actuated_area = data['actuated_area']
-                    self.parent.channel_states = \
-                        self.parent.channel_states.iloc[0:0]
-                    self.parent.update_channel_states(data['channel_states'])
+                    self._queue_channel_states(data['actuated_area'],
+                                               data['channel_states'],
+                                               reset=True)
             elif (self._electrode_commands_registered < 2 and
                   (source == 'dmf_device_ui_plugin')):
                 # Register electrode commands with device UI plugin.
@@ -133,24 +204,193 @@ class DmfZmqPlugin(ZmqPlugin):
             else:
                 self.most_recent = msg_json
         except zmq.Again:
-            pass
+            return False
         except Exception:
             logger.error('Error processing message from subscription '
                          'socket.', exc_info=True)
         return True
 
+    def _queue_channel_states(self, actuated_area, channel_states,
+                              reset=False):
+        '''
+        Merge channel states from an electrode controller reply into the
+        pending channel states update.
+
+        Parameters
+        ----------
+        actuated_area : float
+            Total area of actuated electrodes.
+        channel_states : pandas.Series
+            Modified channel states, indexed by channel number.
+        reset : bool, optional
+            If ``True``, :data:`channel_states` describes the *complete* set
+            of channel states, i.e., discard any previously cached states.
+        '''
+        pending = self._channel_states_update
+        if reset or pending is None:
+            self._channel_states_update = {'reset': reset,
+                                           'channel_states': channel_states}
+        else:
+            pending['channel_states'] = (channel_states
+                                         .combine_first(pending
+                                                        ['channel_states']))
+        self._channel_states_update['actuated_area'] = actuated_area
+
+    def _flush_channel_states(self):
+        '''
+        Apply pending channel states update (if any) to the parent plugin.
+        '''
+        pending = self._channel_states_update
+        if pending is None:
+            return
+        self._channel_states_update = None
+        self.parent.actuated_area = pending['actuated_area']
+        self.parent.update_channel_states(pending['channel_states'],
+                                          reset=pending['reset'])
+
+    def pending_messages(self):
+        '''
+        Returns
+        -------
+        bool
+            ``True`` if a message is waiting on either the command or the
+            subscription socket.
+        '''
+        return any(socket_i.getsockopt(zmq.EVENTS) & zmq.POLLIN
+                   for socket_i in (self.command_socket,
+                                    self.subscribe_socket))
+
+    def watch_sockets(self):
+        '''
+        Register the file descriptors of the command and subscription sockets
+        with the GLib main loop.
+
+        Messages are processed by :meth:`on_socket_event` as soon as they
+        arrive, rather than by periodically polling :meth:`check_sockets`.
+
+        Returns
+        -------
+        list
+            GLib event source identifiers (to be removed using
+            :func:`gobject.source_remove`).
+
+        .. versionadded:: 2.4.0
+        '''
+        return [gobject.io_add_watch(socket_i.getsockopt(zmq.FD),
+                                     gobject.IO_IN, self.on_socket_event)
+                for socket_i in (self.command_socket, self.subscribe_socket)]
+
+    def on_socket_event(self, *args):
+        '''
+        Process all messages pending on the command and subscription sockets.
+
+        The file descriptor of a ZeroMQ socket is *edge-triggered*, i.e., it
+        only signals when the socket transitions to having pending messages.
+        The sockets must therefore be drained completely; otherwise, messages
+        left in the queue would not trigger another event.  If messages are
+        still pending after the processing budget of :meth:`check_sockets` is
+        exhausted, the remaining messages are processed when the main loop is
+        idle.
+
+        .. versionadded:: 2.4.0
+        '''
+        if self._defer_sockets():
+            return True
+        self.check_sockets()
+        if self.pending_messages() and self._idle_drain_id is None:
+            # Processing budget of `check_sockets` was exhausted.  Process
+            # remaining messages once other pending main loop events have been
+            # handled.
+            self._idle_drain_id = gobject.idle_add(self._drain_sockets)
+        # [Return `True`][1] to keep the event source installed.
+        #
+        # [1]: http://www.pygtk.org/pygtk2reference/gobject-functions.html#function-gobject--io-add-watch
+        return True
+
+    def _drain_sockets(self):
+        if self._defer_sockets():
+            self._idle_drain_id = None
+            return False
+        self.check_sockets()
+        if self.pending_messages():
+            return True
+        self._idle_drain_id = None
+        return False
+
+    def _defer_sockets(self):
+        '''
+        Returns
+        -------
+        bool
+            ``True`` if the parent plugin is waiting for a hardware request
+            (see :meth:`DMFControlBoardPlugin.wait_for_hardware`), in which
+            case messages **MUST** not be processed, since a message handler
+            may, for example, modify the channel states of a step that is only
+            partially applied.  Deferred messages are processed by
+            :meth:`resume_sockets`.
+
+        .. versionadded:: 2.4.0
+        '''
+        if self.parent.hardware_waits:
+            self._sockets_deferred = True
+            return True
+        return False
+
+    def resume_sockets(self):
+        '''
+        Process messages deferred while the parent plugin was waiting for a
+        hardware request.
+
+        .. versionadded:: 2.4.0
+        '''
+        if self._sockets_deferred:
+            self._sockets_deferred = False
+            self.on_socket_event()
+
+    def cancel_drain(self):
+        '''
+        Cancel processing of remaining messages scheduled by
+        :meth:`on_socket_event`.
+        '''
+        if self._idle_drain_id is not None:
+            gobject.source_remove(self._idle_drain_id)
+            self._idle_drain_id = None
+
     def on_execute__channel_count(self, request):
-        return self.parent.control_board.number_of_channels()
+        return self.parent.get_device_info().number_of_channels
+
+    def on_execute__channel_write_counts(self, request):
+        '''
+        Returns
+        -------
+        dict
+            Number of channel state writes ``issued`` to the control board and
+            number of writes ``skipped`` since the requested states matched
+            the states already applied.
+        '''
+        return self.parent.channel_writes.counts()
 
     def on_execute__measure_impedance(self, request):
         '''
         Measure impedance while the channels specified by `state` field are
         actuated (no actuated channels by default).
+
+        .. versionchanged:: 2.4.0
+            If the ``async`` field is set, reply immediately with a request id
+            and send a ``request_complete`` notification with the measurement
+            once it completes (see :meth:`_execute_async`).
         '''
         data = decode_content_data(request)
         control_board = self.parent.control_board
 
         n_sampling_windows = data.pop('n_sampling_windows')
+        if data.pop('async', False):
+            return self._execute_async(request, lambda: self
+                                       .submit_measurement(control_board
+                                                           .measure_impedance,
+                                                           n_sampling_windows,
+                                                           **data),
+                                       feedback_results_to_impedance_frame)
         feedback_results = self.measure(control_board.measure_impedance,
                                         n_sampling_windows, **data)
         return feedback_results_to_impedance_frame(feedback_results)
@@ -159,14 +399,221 @@ class DmfZmqPlugin(ZmqPlugin):
         '''
         Measure impedance while the channels specified by `state` field are
         actuated (no actuated channels by default).
+
+        .. versionchanged:: 2.4.0
+            If the ``async`` field is set, reply immediately with a request id
+            and send a ``request_complete`` notification with the
+            measurements once the sweep completes (see
+            :meth:`_execute_async`).
+
+        .. versionchanged:: 2.4.0
+            If the ``stream`` field is set, process the request asynchronously
+            and send the measurements for each channel in a
+            ``sweep_channels_row`` notification as soon as the channel has
+            been measured (see :meth:`_sweep_channels_stream`).  The optional
+            ``chunk_size`` field sets the number of channels measured per
+            notification (1 by default).
         '''
         data = decode_content_data(request)
         control_board = self.parent.control_board
         n_sampling_windows = data.pop('n_sampling_windows')
+        if data.pop('stream', False):
+            data.pop('async', None)
+            chunk_size = max(1, int(data.pop('chunk_size', 1)))
+            request_id = request['header']['msg_id']
+            stop_event = threading.Event()
+
+            def _submit():
+                self._sweep_stop_events[request_id] = stop_event
+                future = self.submit_measurement(
+                    partial(self._sweep_channels_stream,
+                            request['header']['source'], request_id,
+                            stop_event, chunk_size), n_sampling_windows,
+                    **data)
+                future.add_done_callback(lambda future: self._sweep_stop_events
+                                         .pop(request_id, None))
+                return future
+            return self._execute_async(request, _submit)
+        elif data.pop('async', False):
+            return self._execute_async(request, lambda: self
+                                       .submit_measurement(control_board
+                                                           .sweep_channels,
+                                                           n_sampling_windows,
+                                                           **data))
         df_impedances = self.measure(control_board.sweep_channels,
                                      n_sampling_windows, **data)
         return df_impedances
 
+    def on_execute__cancel(self, request):
+        '''
+        Cancel an asynchronous request that has not started yet.
+
+        The ``request_id`` field must contain the request id returned when
+        the request was queued.
+
+        Returns
+        -------
+        bool
+            ``True`` if the request was cancelled, or ``False`` if the request
+            is already running, has completed, or is unknown.
+        '''
+        data = decode_content_data(request)
+        stop_event = self._sweep_stop_events.get(data['request_id'])
+        if stop_event is not None:
+            # Stop streaming channel sweep after the current channel.
+            stop_event.set()
+            return True
+        future = self._async_requests.get(data['request_id'])
+        return future is not None and future.cancel()
+
+    @gtk_threadsafe
+    def _publish_sweep_channels_row(self, target, request_id, df_impedances):
+        self.notify(target, 'sweep_channels_row',
+                    {'request_id': request_id, 'impedances': df_impedances})
+
+    def _sweep_channels_stream(self, target, request_id, stop_event,
+                               chunk_size, sampling_window_ms,
+                               n_sampling_windows, delay_between_windows_ms,
+                               interleave_samples, use_rms, channel_mask):
+        '''
+        Measure impedance of each channel in :data:`channel_mask`,
+        :data:`chunk_size` channels at a time.
+
+        Each chunk of channels is swept using
+        :meth:`DMFControlBoard.sweep_channels` (with a channel mask containing
+        only the channels in the chunk), and the measurements are sent to the
+        :data:`target` plugin (and broadcast on the hub publish socket) in a
+        ``sweep_channels_row`` notification (see :meth:`notify`), including
+        the ``request_id`` of the sweep, as soon as the chunk has been
+        measured.  Downstream tools may cancel the sweep (see
+        :meth:`on_execute__cancel`) to stop after the current chunk.
+
+        **MUST** be executed in the hardware worker thread.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Measurements for all channels swept.
+
+        .. versionadded:: 2.4.0
+        '''
+        control_board = self.parent.control_board
+        channel_mask = np.asarray(channel_mask, dtype=int)
+        channels = np.flatnonzero(channel_mask)
+        frames = []
+        for start_i in xrange(0, channels.size, chunk_size):
+            if stop_event.is_set():
+                logger.info('[sweep_channels] request %s cancelled after %d '
+                            'channel(s).', request_id, start_i)
+                break
+            chunk_mask_i = np.zeros_like(channel_mask)
+            chunk_mask_i[channels[start_i:start_i + chunk_size]] = 1
+            df_result_i = \
+                control_board.sweep_channels(sampling_window_ms,
+                                             n_sampling_windows,
+                                             delay_between_windows_ms,
+                                             interleave_samples, use_rms,
+                                             chunk_mask_i)
+            frames.append(df_result_i)
+            self._publish_sweep_channels_row(target, request_id, df_result_i)
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames)
+
+    def _execute_async(self, request, submit, transform=None):
+        '''
+        Process a request asynchronously.
+
+        The request is submitted to the hardware worker thread and the
+        ``execute_reply`` for the request is sent immediately, containing the
+        request id.  Once the request completes, a ``request_complete``
+        notification (see :meth:`notify`) is sent to the source of the
+        request, containing the ``request_id``, the ``command`` and the
+        (transformed) ``result``.  If the request failed (or was cancelled),
+        the notification status is ``error`` (or ``abort``) and the
+        notification includes the error.
+
+        Parameters
+        ----------
+        request : dict
+            Request message.
+        submit : function
+            Function to submit the request to the hardware worker; returns a
+            :class:`hardware.HardwareFuture`.
+        transform : function, optional
+            Function to apply to the result before sending the notification.
+
+        Returns
+        -------
+        dict
+            ``request_id`` and ``status`` of the queued request.
+
+        .. versionadded:: 2.4.0
+        '''
+        request_id = request['header']['msg_id']
+        source = request['header']['source']
+        command = request['content']['command']
+        future = submit()
+        self._async_requests[request_id] = future
+
+        def on_done(future):
+            # Called in the main GTK thread.
+            self._async_requests.pop(request_id, None)
+            data = {'request_id': request_id, 'command': command}
+            try:
+                result = future.result()
+                data['result'] = (result if transform is None
+                                  else transform(result))
+            except HardwareRequestCancelled, exception:
+                self.notify(source, 'request_complete', data, status='abort',
+                            error=exception)
+            except Exception, exception:
+                logger.error('[%s] request %s failed.', command, request_id,
+                             exc_info=True)
+                self.notify(source, 'request_complete', data, status='error',
+                            error=exception)
+            else:
+                self.notify(source, 'request_complete', data)
+        future.add_done_callback(on_done)
+        return {'request_id': request_id, 'status': 'queued'}
+
+    def notify(self, target, command, data=None, status='ok', error=None):
+        '''
+        Send a notification to a plugin through the hub.
+
+        A notification is an ``execute_reply`` message with its own session
+        that does not correspond to any request, so it does not interfere with
+        replies the target is waiting for.  Like any message routed through
+        the hub, the notification is also broadcast to all plugins on the hub
+        publish socket.
+
+        **MUST** be called from the main GTK thread.
+
+        Parameters
+        ----------
+        target : str
+            Name of plugin to notify.
+        command : str
+            Name of the notification.
+        data : object, optional
+            Notification data (pickled).
+        status : str, optional
+            One of ``'ok'``, ``'error'``, ``'abort'``.
+        error : Exception, optional
+            Error to include in the notification (if applicable).
+
+        .. versionadded:: 2.4.0
+        '''
+        content = {'command': command, 'status': status,
+                   'execution_count': self.execute_reply_id.next(),
+                   'silent': False}
+        content.update(encode_content_data(data))
+        if error is not None:
+            content['error'] = str(error)
+        self.send_command({'header': get_header(self.name, target,
+                                                'execute_reply'),
+                           'content': content})
+
     def on_execute__measure_cap_filler(self, request):
         '''
         Measure capacitance of actuated electrodes as filler (e.g., air, oil).
@@ -187,74 +634,205 @@ class DmfZmqPlugin(ZmqPlugin):
         '''
         Measure impedance while the channels specified by `state` field are
         actuated (no actuated channels by default).
+
+        .. versionchanged:: 2.4.0
+            Perform measurement in the hardware worker thread (see
+            :meth:`submit_measurement`) while continuing to process GTK
+            events (see :meth:`DMFControlBoardPlugin.wait_for_hardware`).
+        '''
+        return self.parent.wait_for_hardware(
+            self.submit_measurement(measure_func, n_sampling_windows,
+                                    **kwargs))
+
+    def submit_measurement(self, measure_func, n_sampling_windows, **kwargs):
+        '''
+        Queue impedance measurement in the hardware worker thread.
+
+        See :meth:`measure` for parameters.
+
+        Returns
+        -------
+        hardware.HardwareFuture
+            Measurement result.
+
+        .. versionadded:: 2.4.0
         '''
+        # Waveform settings are modified directly (i.e., not through the
+        # parent plugin).
+        self.parent._realtime_waveform = None
+        self.parent.waveform.invalidate()
+        # Measurement overrides the channel states applied by the parent
+        # plugin.
+        self.parent.channel_states.dirty = True
+        self.parent.channel_writes.invalidate()
+
+        app_values = self.parent.get_app_values()
+
+        # Set unspecified measurement parameters to plugin app option
+        # values.
+        sampling_window_ms = kwargs.get('sampling_window_ms',
+                                        app_values['sampling_window_ms'])
+        delay_between_windows_ms = kwargs.get('delay_between_windows_ms',
+                                              app_values
+                                              ['delay_between_windows_ms'])
+        interleave_samples = kwargs.get('interleave_samples', app_values
+                                        ['interleave_feedback_samples'])
+        use_rms = kwargs.get('use_rms', app_values['use_rms'])
+        state = kwargs.get('state')
+        if state is None:
+            # Turn off all channels by default.  Number of channels is read
+            # here (i.e., in the main GTK thread) since the identity of the
+            # control board is only updated in the main GTK thread.
+            state = self.parent.get_device_info().number_of_channels * [0]
+
+        return self.parent.hardware.submit(self._measure, measure_func,
+                                           sampling_window_ms,
+                                           n_sampling_windows,
+                                           delay_between_windows_ms,
+                                           interleave_samples, use_rms,
+                                           state,
+                                           voltage=kwargs.get('voltage'),
+                                           frequency=kwargs.get('frequency'))
+
+    def _measure(self, measure_func, sampling_window_ms, n_sampling_windows,
+                 delay_between_windows_ms, interleave_samples, use_rms,
+                 state, voltage=None, frequency=None):
+        # Executed in hardware worker thread.
         control_board = self.parent.control_board
 
-        if 'voltage' in kwargs:
+        if voltage is not None:
             start_voltage = control_board.waveform_voltage()
-            control_board.set_waveform_voltage(kwargs['voltage'])
-        if 'frequency' in kwargs:
-            control_board.set_waveform_frequency(kwargs['frequency'])
+            control_board.set_waveform_voltage(voltage)
+        if frequency is not None:
             start_frequency = control_board.waveform_frequency()
+            control_board.set_waveform_frequency(frequency)
 
         try:
-            app_values = self.parent.get_app_values()
-
-            # Set unspecified measurement parameters to plugin app option
-            # values.
-            sampling_window_ms = kwargs.get('sampling_window_ms',
-                                            app_values['sampling_window_ms'])
-            delay_between_windows_ms = kwargs.get('delay_between_windows_ms',
-                                                  app_values
-                                                  ['delay_between_windows_ms'])
-            interleave_samples = kwargs.get('interleave_samples', app_values
-                                            ['interleave_feedback_samples'])
-            use_rms = kwargs.get('use_rms', app_values['use_rms'])
-
-            channel_count = control_board.number_of_channels()
-            state = kwargs.get('state', channel_count * [0])
             return measure_func(sampling_window_ms,
                                 n_sampling_windows,
                                 delay_between_windows_ms, interleave_samples,
                                 use_rms, state)
         finally:
             # Restore original voltage and frequency as required.
-            if 'voltage' in kwargs:
+            if voltage is not None:
                 control_board.set_waveform_voltage(start_voltage)
-            if 'frequency' in kwargs:
+            if frequency is not None:
                 control_board.set_waveform_frequency(start_frequency)
 
 
+def _feedback_results_step_frame(start_time, step_index, step_start_time,
+                                 feedback_results):
+    '''
+    Parameters
+    ----------
+    start_time : pandas.Timestamp
+        Start time of the protocol.
+    step_index : int
+        Index of the step in the experiment log.
+    step_start_time : float
+        Start time of the step (in seconds), relative to the beginning of the
+        protocol.
+    feedback_results : dmf_control_board_firmware.FeedbackResults or
+    .results_store.FeedbackResultsRef
+        Feedback results for the step (a reference is loaded without caching
+        the loaded feedback results).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Feedback results for the step, indexed by ``utc_timestamp``.
+
+    .. versionadded:: 2.4.0
+    '''
+    # reset index (step_time is no longer unique for the full dataset)
+    df = load_feedback_results(feedback_results).to_frame().reset_index()
+
+    # add step_index and utc_time columns (index by utc_time)
+    df.insert(0, 'step_index', step_index)
+    df.insert(0, 'utc_timestamp', start_time +
+              pd.to_timedelta(step_start_time + df['step_time'].values,
+                              unit='s'))
+    return df.set_index('utc_timestamp')
+
+
+def experiment_log_directory(log):
+    '''
+    Parameters
+    ----------
+    log : microdrop.experiment_log.ExperimentLog
+        Experiment log.
+
+    Returns
+    -------
+    path_helpers.path
+        Directory containing the experiment log data file, i.e., the
+        directory stored feedback results are relative to (see
+        :meth:`DMFControlBoardPlugin._store_feedback_results`).
+
+    .. versionadded:: 2.4.0
+    '''
+    filename = getattr(log, 'filename', None)
+    if filename:
+        # Log was loaded from file (possibly after being moved).
+        return path(filename).abspath().parent
+    return path(log.directory).joinpath(str(log.experiment_id)).abspath()
+
+
+def bind_experiment_log_feedback_results(log, results=None):
+    '''
+    Resolve references to stored feedback results in an experiment log
+    relative to the experiment log directory (see
+    :func:`.results_store.bind_feedback_results`).
+
+    Parameters
+    ----------
+    log : microdrop.experiment_log.ExperimentLog
+        Experiment log.
+    results : list, optional
+        ``FeedbackResults`` entries of :data:`log` (read from :data:`log` by
+        default).
+
+    Returns
+    -------
+    list
+        ``FeedbackResults`` entries of :data:`log`.
+
+    .. versionadded:: 2.4.0
+    '''
+    if results is None:
+        results = log.get('FeedbackResults',
+                          plugin_name=get_plugin_info(path(__file__).parent)
+                          .plugin_name)
+    if any(isinstance(results_i, FeedbackResultsRef) for results_i in results):
+        bind_feedback_results(results, experiment_log_directory(log))
+    return results
+
+
 def microdrop_experiment_log_to_feedback_results_df(log):
+    '''
+    .. versionchanged:: 2.4.0
+        Concatenate the frames of all steps at once and compute timestamps
+        using vectorized time deltas (rather than appending each step and
+        computing the timestamp of each sample separately).
+    '''
     # get the FeedbackResults object for each step
-    results = log.get('FeedbackResults',
-                      plugin_name=get_plugin_info(path(__file__).parent)
-                      .plugin_name)
+    results = bind_experiment_log_feedback_results(log)
 
     # Get the start time for each step (in seconds), relative to the beginning
     # of the protocol.
     step_start_time = log.get('time')
 
-    start_time = arrow.get(log.get('start time')[0])
-
-    # combine all steps in the protocol into a single dataframe
-    feedback_results_df = pd.DataFrame()
-    for i, step in enumerate(results):
-        if step is None:
-            continue
-        else:
-            # reset index (step_time is no longer unique for the full dataset)
-            df = step.to_frame().reset_index()
+    import arrow
 
-            # add step_index and utc_time columns (index by utc_time)
-            df.insert(0, 'step_index', i)
-            df.insert(0, 'utc_timestamp', [start_time.replace(
-                        seconds=step_start_time[i] + t).datetime
-                                      for t in df['step_time']])
-            df.set_index('utc_timestamp', inplace=True)
+    start_time = pd.Timestamp(arrow.get(log.get('start time')[0]).datetime)
 
-            feedback_results_df = feedback_results_df.append(df)
-    return feedback_results_df
+    # combine all steps in the protocol into a single dataframe
+    frames = [_feedback_results_step_frame(start_time, i, step_start_time[i],
+                                           step)
+              for i, step in enumerate(results) if step is not None]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames)
 
 
 def feedback_results_df_to_step_summary_df(feedback_results_df):
@@ -293,6 +871,168 @@ def feedback_results_df_to_step_summary_df(feedback_results_df):
     return steps.reset_index().set_index('utc_timestamp')
 
 
+def export_experiment_log_feedback_results_hdf(log, h5_path,
+                                               chunk_size=100000,
+                                               complevel=5):
+    '''
+    Export feedback results from experiment log to HDF5 file, one chunk of
+    steps at a time.
+
+    Unlike :func:`microdrop_experiment_log_to_feedback_results_df`, the
+    feedback results of the whole experiment are never held in a single
+    data frame; frames for consecutive steps are appended to the
+    ``feedback_results`` table as soon as at least :data:`chunk_size` rows
+    are pending.  The step summary is computed for each step as it is
+    processed and is written to the ``step_summary`` table.
+
+    Parameters
+    ----------
+    log : microdrop.experiment_log.ExperimentLog
+        Experiment log.
+    h5_path : str
+        Output HDF5 file path.  Existing tables in the file are replaced.
+    chunk_size : int, optional
+        Minimum number of feedback result rows to write at a time.
+    complevel : int, optional
+        Compression level (``blosc``).
+
+    Returns
+    -------
+    int
+        Number of feedback result rows written.
+
+    .. versionadded:: 2.4.0
+    '''
+    results = bind_experiment_log_feedback_results(log)
+    step_start_time = log.get('time')
+    import arrow
+
+    start_time = pd.Timestamp(arrow.get(log.get('start time')[0]).datetime)
+
+    row_count = 0
+    pending_frames = []
+    pending_row_count = 0
+    summary_frames = []
+
+    with pd.HDFStore(str(h5_path), mode='a', complevel=complevel,
+                     complib='blosc') as store:
+        for key in ('feedback_results', 'step_summary'):
+            if '/' + key in store.keys():
+                store.remove(key)
+
+        def _flush():
+            store.append('feedback_results', pd.concat(pending_frames),
+                         format='table', data_columns=['step_index'])
+            del pending_frames[:]
+
+        for i, step in enumerate(results):
+            if step is None:
+                continue
+            df_i = _feedback_results_step_frame(start_time, i,
+                                                step_start_time[i], step)
+            # Each step frame contains a single step index, so the summary of
+            # the step does not depend on any other step.
+            summary_frames.append(feedback_results_df_to_step_summary_df(df_i))
+            pending_frames.append(df_i)
+            pending_row_count += df_i.shape[0]
+            if pending_row_count >= chunk_size:
+                _flush()
+                row_count += pending_row_count
+                pending_row_count = 0
+        if pending_frames:
+            _flush()
+            row_count += pending_row_count
+
+        if summary_frames:
+            store.append('step_summary', pd.concat(summary_frames),
+                         format='table')
+    return row_count
+
+
+class FeedbackResultsStepSummary(object):
+    '''
+    Step summary of an experiment, updated incrementally as the feedback
+    results of each step are added to the experiment log.
+
+    Summary rows match the rows of
+    :func:`feedback_results_df_to_step_summary_df`, but each row is computed
+    from the feedback results of a single step, so the summary is available
+    while the protocol is running and no pass over the feedback results of
+    the whole experiment is required to export it.
+
+    .. versionadded:: 2.4.0
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self, experiment_id=None):
+        self.experiment_id = experiment_id
+        self.start_time = None
+        # Summary frame for each step, indexed by experiment log step index.
+        self.step_frames = {}
+
+    def add(self, log, feedback_results):
+        '''
+        Update summary with feedback results of the most recent experiment
+        log step.
+
+        Parameters
+        ----------
+        log : microdrop.experiment_log.ExperimentLog
+            Experiment log (:data:`feedback_results` must be added to the last
+            step of the log).
+        feedback_results : dmf_control_board_firmware.FeedbackResults
+            Feedback results for the last step of the log.
+        '''
+        if log.experiment_id != self.experiment_id:
+            self.reset(log.experiment_id)
+        if self.start_time is None:
+            import arrow
+
+            self.start_time = pd.Timestamp(arrow.get(log.get('start time')[0])
+                                           .datetime)
+        step_index = len(log.data) - 1
+        df_step = _feedback_results_step_frame(self.start_time, step_index,
+                                               log.data[-1]['core']['time'],
+                                               feedback_results)
+        self.step_frames[step_index] = \
+            feedback_results_df_to_step_summary_df(df_step)
+
+    def covers(self, log, results):
+        '''
+        Parameters
+        ----------
+        log : microdrop.experiment_log.ExperimentLog
+            Experiment log.
+        results : list
+            ``FeedbackResults`` for each step in :data:`log` (``None`` for
+            steps without feedback results).
+
+        Returns
+        -------
+        bool
+            ``True`` if the summary includes every step of :data:`log` with
+            feedback results (and no other steps).
+        '''
+        return (log.experiment_id == self.experiment_id and
+                set(self.step_frames) == set(i for i, results_i in
+                                             enumerate(results)
+                                             if results_i is not None))
+
+    def to_frame(self):
+        '''
+        Returns
+        -------
+        pandas.DataFrame
+            Step summary, in the format of
+            :func:`feedback_results_df_to_step_summary_df`.
+        '''
+        if not self.step_frames:
+            return pd.DataFrame()
+        return pd.concat([self.step_frames[i]
+                          for i in sorted(self.step_frames)])
+
+
 class DMFControlBoardOptions(object):
     _default_force = 25.0
 
@@ -380,6 +1120,74 @@ def check_frequency(element, state):
         return True
 
 
+def probe_control_board(port, baud_rate):
+    '''
+    Check for a DMF control board on a serial port, using a separate control
+    board instance (i.e., safe to call concurrently for different ports).
+
+    Parameters
+    ----------
+    port : str
+        Serial port.
+    baud_rate : int
+        Baud rate.
+
+    Returns
+    -------
+    int
+        Serial number of the control board.
+
+    Raises
+    ------
+    IOError
+        If the device on :data:`port` is not a DMF control board.
+
+    .. versionadded:: 2.4.0
+    '''
+    control_board = DMFControlBoard()
+    try:
+        control_board.connect(port, baud_rate)
+        name = control_board.name()
+        if name != "Arduino DMF Controller":
+            raise IOError('Device on %s is not an Arduino DMF Controller '
+                          '(%s)' % (port, name))
+        return control_board.serial_number
+    finally:
+        if control_board.connected():
+            control_board.disconnect()
+
+
+#: Feedback results store types, indexed by `feedback_results_storage` app
+#: option value (``experiment log``: pickle with experiment log).
+FEEDBACK_RESULTS_STORES = {'experiment log': None,
+                           'HDF5 table': (HdfFeedbackResultsStore,
+                                          'feedback_results.h5'),
+                           'memory-mapped arrays': (NpyFeedbackResultsStore,
+                                                    'feedback_results')}
+
+
+def deferred_while_hardware_busy(method):
+    '''
+    Decorator for :class:`DMFControlBoardPlugin` handlers that write to the
+    control board.
+
+    While the plugin is waiting for a hardware request (see
+    :meth:`DMFControlBoardPlugin.wait_for_hardware`) or the hardware worker
+    is busy (e.g., with an asynchronous channel sweep), the call is not
+    handled re-entrantly (or blocked behind the hardware request), but
+    deferred and handled (in order) once the hardware is idle (see
+    :meth:`DMFControlBoardPlugin._defer_call`).
+
+    .. versionadded:: 2.4.0
+    '''
+    @wraps(method)
+    def _method(self, *args, **kwargs):
+        if self._defer_call(method, args, kwargs):
+            return
+        return method(self, *args, **kwargs)
+    return _method
+
+
 class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
     """
     This class is automatically registered with the PluginManager.
@@ -412,6 +1220,16 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                        .using(default=False, optional=True),
                        Boolean.named('use_force_normalization')
                        .using(default=False, optional=True),
+                       Boolean.named('event_driven_sockets')
+                       .using(default=False, optional=True),
+                       Boolean.named('parallel_port_probing')
+                       .using(default=False, optional=True),
+                       String.named('control_board_ports')
+                       .using(default='', optional=True,
+                              properties={'show_in_gui': False}),
+                       Enum.named('feedback_results_storage')
+                       .using(default='experiment log', optional=True)
+                       .valued(*sorted(FEEDBACK_RESULTS_STORES)),
                        String.named('c_drop').using(default='', optional=True,
                                                     properties={'show_in_gui':
                                                                 False}),
@@ -445,18 +1263,38 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
         .. versionchanged:: 2.3.4
             Use :data:`__version__` for plugin version.
         '''
-        self.control_board = DMFControlBoard()
+        # All serial I/O to the control board is performed by the hardware
+        # worker thread.
+        self.hardware = HardwareWorker()
+        # Number of hardware requests currently waited on (see
+        # `wait_for_hardware`), and handler calls deferred in the meantime
+        # (see `deferred_while_hardware_busy`).
+        self.hardware_waits = 0
+        self._deferred_calls = []
+        self._resuming_deferred = False
+        self.hardware.start()
+        self.control_board = ControlBoardProxy(DMFControlBoard(),
+                                               self.hardware)
         self.name = get_plugin_info(path(__file__).parent).plugin_name
         self.url = self.control_board.host_url()
         self.steps = []  # list of steps in the protocol
         self.feedback_options_controller = None
+        # Feedback results and calibration controllers are created on first
+        # use (see `get_feedback_results_controller()` and
+        # `get_feedback_calibration_controller()`).
         self.feedback_results_controller = None
         self.feedback_calibration_controller = None
+        # Most recent experiment log selection.
+        self.experiment_log_selection = []
         self.initialized = False
         self.connection_status = "Not connected"
         self.n_voltage_adjustments = None
         self.amplifier_gain_initialized = False
-        self.current_frequency = None
+        # Waveform voltage and frequency most recently applied to the control
+        # board.
+        self.waveform = WaveformState()
+        # Amplifier gain learned for each waveform frequency.
+        self.amplifier_gains = AmplifierGainCache()
 
         self.timeout_id = None
         self.watchdog_timeout_id = None
@@ -472,9 +1310,35 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                                'Load from file',
                                'Save to file'])]
         self.actuated_area = 0
-        self.channel_states = pd.Series()
+        self.channel_states = ChannelStates()
+        # Shadow copy of channel states most recently written to the control
+        # board.
+        self.channel_writes = ChannelWriteCache()
+        # Identity of connected control board (see `get_device_info()`).
+        self.device_info = None
+        # Step summary of the current experiment, updated as feedback results
+        # are added to the experiment log.
+        self.step_summary = FeedbackResultsStepSummary()
+        # Feedback results store of the current experiment (see
+        # `_store_feedback_results()`).
+        self.feedback_results_store = None
+        # Quantities derived from feedback results (e.g., capacitance),
+        # cached for plotting.
+        self.derived_quantities = DerivedQuantityCache()
+        # Time (in milliseconds) to wait for further channel states updates
+        # before applying the latest channel states (see
+        # `update_channel_states`).
+        self.channel_states_settle_ms = 25
+        # Maximum time (in seconds) to wait for serial port probes (see
+        # `_connect_probing_ports()`).
+        self.port_probe_timeout_s = 5.
+        self.channel_states_timeout_id = None
+        # Voltage and frequency applied by the most recent run of a step
+        # without feedback (see `_callback_apply_channel_states`).
+        self._realtime_waveform = None
         self.plugin = None
         self.plugin_timeout_id = None
+        self.plugin_watch_ids = []
 
         @gtk_threadsafe
         def _init_menu_ui():
@@ -488,29 +1352,155 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
             self.load_log_calibration_menu_item = gtk.MenuItem("Load "
                                                                "calibration "
                                                                "from file")
+            self.export_log_feedback_results_menu_item = \
+                gtk.MenuItem("Export feedback results to HDF5...")
+            self.feedback_results_menu_item = gtk.MenuItem("Feedback Results")
         _init_menu_ui()
 
-    def update_channel_states(self, channel_states):
-        # Update locally cached channel states with new modified states.
+    def update_channel_states(self, channel_states, reset=False):
+        '''
+        Update locally cached channel states with new modified states.
+
+        Parameters
+        ----------
+        channel_states : pandas.Series
+            Modified channel states, indexed by channel number.
+        reset : bool, optional
+            If ``True``, turn off all channels not included in
+            :data:`channel_states`.
+
+        .. versionchanged:: 2.4.0
+            Apply the cached channel states once no further updates have been
+            received for :attr:`channel_states_settle_ms` milliseconds, rather
+            than re-running the step for every update.  Channel states are
+            cached in a :class:`ChannelStates` buffer and are only applied if
+            they differ from the states last applied.  Add :data:`reset`
+            parameter.
+        '''
         try:
-            self.channel_states = channel_states.combine_first(self
-                                                               .channel_states)
-        except ValueError:
+            self.channel_states.update(channel_states.index,
+                                       channel_states.values, reset=reset)
+        except (IndexError, ValueError):
             logging.info('channel_states: %s', channel_states)
-            logging.info('self.channel_states: %s', self.channel_states)
+            logging.info('self.channel_states: %s',
+                         self.channel_states.states)
             logging.info('', exc_info=True)
         else:
-            app = get_app()
-            if self.control_board.connected() and (app.realtime_mode or
-                                                   app.running):
+            if (self.channel_states.dirty and
+                    self.channel_states_timeout_id is None):
+                self.channel_states_timeout_id = gobject.timeout_add(
+                    self.channel_states_settle_ms,
+                    self._callback_apply_channel_states)
+
+    def _callback_apply_channel_states(self):
+        if self.hardware.busy():
+            # Wait for outstanding hardware requests (e.g., a measurement) to
+            # complete before re-running the step.
+            return True
+        self.channel_states_timeout_id = None
+        app = get_app()
+        if not self.channel_states.dirty:
+            # Channel states have already been applied (e.g., by a step run).
+            pass
+        elif self.control_board.connected() and (app.realtime_mode or
+                                                 app.running):
+            options = self.get_step_options()
+            if (not app.running and
+                    not options.feedback_options.feedback_enabled and
+                    self._realtime_waveform == (options.voltage,
+                                                options.frequency)):
+                # Only the channel states have changed since the step was last
+                # run, so there is no need to re-apply the waveform settings
+                # or to check the device impedance.
+                logger.debug('[DMFControlBoardPlugin] '
+                             '_callback_apply_channel_states: update channel '
+                             'states only')
+                self.set_state_of_all_channels(self._channel_states_array())
+                self.channel_states.dirty = False
+            else:
                 self.on_step_run()
+        return False  # Stop the timeout from refiring
+
+    def _cancel_channel_states_update(self):
+        if self.channel_states_timeout_id is not None:
+            gobject.source_remove(self.channel_states_timeout_id)
+            self.channel_states_timeout_id = None
+
+    def _channel_states_array(self):
+        '''
+        Returns
+        -------
+        numpy.ndarray
+            State of every channel on the control board, where channels not
+            set explicitly default to off.
+        '''
+        return self.channel_states.to_array(self.get_device_info()
+                                            .number_of_channels)
 
     def cleanup_plugin(self):
-        if self.plugin_timeout_id is not None:
-            gobject.source_remove(self.plugin_timeout_id)
+        self._remove_socket_sources()
         if self.plugin is not None:
             self.plugin = None
 
+    def _on_wizard_close(self, *args):
+        '''
+        Handler called when a wizard that switches channels directly (e.g.,
+        the channels test or a calibration wizard) is closed.
+
+        The channel states and waveform applied by the wizard are unknown, so
+        channel states, voltage and frequency are re-applied on the next step
+        run.  Calibration wizards also change the amplifier gain and the
+        calibration of the control board, so learned amplifier gains and
+        cached control board attributes are discarded.
+
+        .. versionadded:: 2.4.0
+        '''
+        self.channel_writes.invalidate()
+        self.channel_states.dirty = True
+        self.waveform.invalidate()
+        self._realtime_waveform = None
+        self.amplifier_gains.clear()
+        self.amplifier_gain_initialized = False
+        self.control_board.invalidate_cache()
+
+    def _remove_socket_sources(self):
+        if self.plugin is not None:
+            self.plugin.cancel_drain()
+        if self.plugin_timeout_id is not None:
+            gobject.source_remove(self.plugin_timeout_id)
+            self.plugin_timeout_id = None
+        for watch_id in self.plugin_watch_ids:
+            gobject.source_remove(watch_id)
+        self.plugin_watch_ids = []
+
+    def _add_socket_sources(self):
+        '''
+        Install GLib event sources to process messages received on the 0MQ
+        plugin sockets.
+
+        If the ``event_driven_sockets`` app option is set, messages are
+        processed as soon as they arrive on the sockets (see
+        :meth:`DmfZmqPlugin.watch_sockets`).  Otherwise, the sockets are
+        polled every 10 ms.
+
+        .. versionadded:: 2.4.0
+        '''
+        self._remove_socket_sources()
+        if self.get_app_values().get('event_driven_sockets'):
+            self.plugin_watch_ids = self.plugin.watch_sockets()
+            # ZeroMQ socket file descriptors are edge-triggered, so an event
+            # may be missed if a socket is accessed outside of the socket
+            # event handler (e.g., to send a request).  Check the sockets
+            # occasionally as a fallback.
+            self.plugin_timeout_id = gobject.timeout_add(
+                500, self.plugin.on_socket_event)
+        else:
+            # Periodically process outstanding message received on plugin
+            # sockets.
+            self.plugin_timeout_id = gtk.timeout_add(10,
+                                                     self.plugin.check_sockets)
+
+    @deferred_while_hardware_busy
     def on_plugin_enable(self):
         '''
         .. versionchanged:: 2.3.3
@@ -527,24 +1517,25 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
         # Initialize sockets.
         self.plugin.reset()
 
-        # Periodically process outstanding message received on plugin sockets.
-        self.plugin_timeout_id = gtk.timeout_add(10, self.plugin.check_sockets)
+        self._add_socket_sources()
 
         @gtk_threadsafe
         def _init_ui():
             self.feedback_options_controller = FeedbackOptionsController(self)
-            self.feedback_results_controller = FeedbackResultsController(self)
-            self.feedback_calibration_controller = (
-                FeedbackCalibrationController(self))
             self.edit_log_calibration_menu_item.connect(
-                "activate",
-                self.feedback_calibration_controller.on_edit_log_calibration)
+                "activate", lambda *args: self
+                .get_feedback_calibration_controller()
+                .on_edit_log_calibration(*args))
             self.save_log_calibration_menu_item.connect(
-                "activate",
-                self.feedback_calibration_controller.on_save_log_calibration)
+                "activate", lambda *args: self
+                .get_feedback_calibration_controller()
+                .on_save_log_calibration(*args))
             self.load_log_calibration_menu_item.connect(
-                "activate",
-                self.feedback_calibration_controller.on_load_log_calibration)
+                "activate", lambda *args: self
+                .get_feedback_calibration_controller()
+                .on_load_log_calibration(*args))
+            self.export_log_feedback_results_menu_item.connect(
+                "activate", self.on_export_log_feedback_results)
 
             experiment_log_controller = get_service_instance_by_name(
                 "microdrop.gui.experiment_log_controller", "microdrop")
@@ -556,9 +1547,17 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                     self.save_log_calibration_menu_item)
                 experiment_log_controller.popup.add_item(
                     self.load_log_calibration_menu_item)
+                experiment_log_controller.popup.add_item(
+                    self.export_log_feedback_results_menu_item)
 
             app = get_app()
 
+            app.main_window_controller.menu_view.append(
+                self.feedback_results_menu_item)
+            self.feedback_results_menu_item.connect(
+                "activate", lambda *args: self
+                .get_feedback_results_controller().on_window_show(*args))
+
             self.control_board_menu_item = gtk.MenuItem("DMF control board")
             app.main_window_controller.menu_tools.append(
                 self.control_board_menu_item)
@@ -610,13 +1609,19 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                 Append results to an [HDF][1] file, where measurements from the
                 same run share a common value in the `timestamp` column.
                 '''
+                from .wizards import MicrodropChannelsAssistantView
+
+                # The wizard switches channels directly.
+                self.channel_writes.invalidate()
                 view = MicrodropChannelsAssistantView(self.control_board)
 
                 def on_close(*args):
                     view.to_hdf(self.calibrations_dir()
                                 .joinpath('[%05d]-channels.h5' %
-                                          self.control_board.serial_number))
+                                          self.get_device_info()
+                                          .serial_number))
                 view.widget.connect('close', on_close)
+                view.widget.connect('close', self._on_wizard_close)
                 view.show()
 
             # Connect the action for each menu item to the corresponding
@@ -638,20 +1643,21 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
             menu = self.menu_items['Calibration']
             menu['Calibrate reference load'][0].connect(
                 'activate',
-                self.feedback_calibration_controller.on_perform_calibration)
+                lambda *args: self.get_feedback_calibration_controller()
+                .on_perform_calibration(*args))
             menu['Open reference load calibration'][0].connect(
                 'activate',
                 lambda *args:
-                self.feedback_calibration_controller
+                self.get_feedback_calibration_controller()
                 .load_reference_calibration())
             menu['Calibrate device load'][0].connect(
                 'activate',
-                lambda *args: self.feedback_calibration_controller
+                lambda *args: self.get_feedback_calibration_controller()
                 .calibrate_impedance())
             menu['Open device load calibration'][0].connect(
                 'activate',
                 lambda *args:
-                self.feedback_calibration_controller
+                self.get_feedback_calibration_controller()
                 .load_impedance_calibration())
 
             self.initialized = True
@@ -665,7 +1671,7 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
         def _refresh_ui():
             self.control_board_menu_item.show()
             self.edit_log_calibration_menu_item.show()
-            self.feedback_results_controller.feedback_results_menu_item.show()
+            self.feedback_results_menu_item.show()
 
         _refresh_ui()
 
@@ -673,16 +1679,19 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
             self.on_step_run()
             self._update_protocol_grid()
 
+    @deferred_while_hardware_busy
     def on_plugin_disable(self):
         self.cleanup_plugin()
+        self._cancel_channel_states_update()
         self.feedback_options_controller.on_plugin_disable()
 
         @gtk_threadsafe
         def _refresh_ui():
             self.control_board_menu_item.hide()
             self.edit_log_calibration_menu_item.hide()
-            self.feedback_results_controller.window.hide()
-            self.feedback_results_controller.feedback_results_menu_item.hide()
+            if self.feedback_results_controller is not None:
+                self.feedback_results_controller.window.hide()
+            self.feedback_results_menu_item.hide()
 
         _refresh_ui()
 
@@ -690,6 +1699,7 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
             self.on_step_run()
             self._update_protocol_grid()
 
+    @deferred_while_hardware_busy
     def on_app_exit(self):
         """
         Handler called just before the Microdrop application exits.
@@ -728,6 +1738,7 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
 
                 pgc.update_grid()
 
+    @deferred_while_hardware_busy
     def on_app_options_changed(self, plugin_name):
         '''
         .. versionchanged:: 2.3.3
@@ -778,6 +1789,9 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
         app = get_app()
 
         if plugin_name == self.name:
+            if self.plugin is not None:
+                # Socket servicing mode may have changed.
+                self._add_socket_sources()
             _cached_capacitance_prompt_and_serial_settings()
         elif plugin_name == app.name:
             if self.control_board.connected() and (not app.realtime_mode and
@@ -785,8 +1799,9 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                 # We're not in realtime mode and not running a protocol.
                 # Turn off all electrodes.
                 logger.info('Turning off all electrodes.')
-                self.control_board.set_state_of_all_channels(
-                    np.zeros(self.control_board.number_of_channels()))
+                self.set_state_of_all_channels(
+                    np.zeros(self.get_device_info().number_of_channels))
+                self.channel_states.dirty = True
         if self.feedback_options_controller:
             (self.feedback_options_controller
              .on_app_options_changed(plugin_name))
@@ -798,9 +1813,19 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
 
         If unsuccessful, try to connect to the control board on any available
         serial port, one-by-one.
+
+        .. versionchanged:: 2.4.0
+            If the ``parallel_port_probing`` app option is set, probe all
+            other available serial ports concurrently if the control board is
+            not found on the most recently connected port (see
+            :meth:`_connect_probing_ports`).
         '''
-        self.current_frequency = None
+        self.waveform.invalidate()
+        self.device_info = None
+        self.control_board.invalidate_cache()
+        self.amplifier_gains.clear()
         self.amplifier_gain_initialized = False
+        self._realtime_waveform = None
         # Get list of Mega2560 serial ports.
         comports = dmf.serial_ports().index.tolist()
         if len(comports):
@@ -817,13 +1842,213 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                                'connected port (%s). Checking other ports...',
                                most_recent_port)
             # Try to connect to control board on available ports.
-            self.control_board.connect(comports, app_values['baud_rate'])
+            if app_values.get('parallel_port_probing') and len(comports) > 1:
+                self._connect_probing_ports(comports, app_values)
+            else:
+                self.control_board.connect(comports, app_values['baud_rate'])
+            self._update_device_info()
             app_values['serial_port'] = self.control_board.port
+            self._cache_control_board_port(app_values)
+            self.channel_states.resize(self.get_device_info()
+                                       .number_of_channels)
+            # Channel states must be applied to the newly connected board.
+            self.channel_states.dirty = True
+            self.channel_writes.invalidate()
             self.set_app_values(app_values)
         else:
             raise Exception("No serial ports available.")
         self._update_watchdog(app_values['auto_atx_power_off'])
 
+    def get_device_info(self):
+        '''
+        Returns
+        -------
+        .hardware.DeviceInfo
+            Identity (name, versions, number of channels, serial number) of
+            the connected control board, queried once per connection (or
+            after loading a configuration; see :meth:`_update_device_info`).
+
+        Raises
+        ------
+        IOError
+            If no control board is connected.
+
+        .. versionadded:: 2.4.0
+        '''
+        if self.device_info is None:
+            raise IOError('No control board connected.')
+        return self.device_info
+
+    def _update_device_info(self):
+        '''
+        Query identity of the connected control board (see
+        :meth:`get_device_info`).
+
+        **MUST** be called from the main GTK thread, e.g., right after
+        connecting to the control board.
+
+        .. versionadded:: 2.4.0
+        '''
+        self.device_info = None
+        if self.control_board.connected():
+            self.device_info = \
+                DeviceInfo.from_control_board(self.control_board)
+
+    def _control_board_ports(self, app_values):
+        '''
+        Returns
+        -------
+        dict
+            Serial port most recently connected to each control board, indexed
+            by control board serial number (cached in the hidden
+            ``control_board_ports`` app option).
+
+        .. versionadded:: 2.4.0
+        '''
+        try:
+            return dict(json.loads(app_values.get('control_board_ports') or
+                                   '{}'))
+        except (TypeError, ValueError):
+            return {}
+
+    def _cache_control_board_port(self, app_values):
+        '''
+        Record serial port of connected control board in the hidden
+        ``control_board_ports`` app option (see :meth:`_control_board_ports`).
+
+        .. versionadded:: 2.4.0
+        '''
+        try:
+            serial_number = str(self.get_device_info().serial_number)
+        except Exception:
+            logger.debug('Could not read control board serial number.',
+                         exc_info=True)
+            return
+        ports = self._control_board_ports(app_values)
+        ports[serial_number] = self.control_board.port
+        app_values['control_board_ports'] = json.dumps(ports, sort_keys=True)
+
+    def _connect_probing_ports(self, comports, app_values):
+        '''
+        Connect to the control board, probing serial ports concurrently.
+
+        The control board is connected directly to the most recently
+        connected port (if available), i.e., in the common case, no port is
+        probed at all.  Otherwise (or if the serial number of the control
+        board does not match the serial number cached for the port; see
+        :meth:`_control_board_ports`), all other ports are probed
+        concurrently, each in its own thread (see
+        :func:`probe_control_board`), and the control board is connected to
+        the first port (in the order of :data:`comports`) where a control
+        board with the expected serial number, or else any control board, is
+        found.
+
+        Probes are allowed at most :attr:`port_probe_timeout_s` seconds, and
+        timed out probes are given another :attr:`port_probe_timeout_s`
+        seconds to close their port.  Ports of probes that are still running
+        are not connected to.
+
+        Parameters
+        ----------
+        comports : list
+            Available serial ports (most recently connected port first).
+        app_values : dict
+            Plugin app option values.
+
+        Raises
+        ------
+        IOError
+            If no control board was found.
+
+        .. versionadded:: 2.4.0
+        '''
+        baud_rate = app_values['baud_rate']
+        # Serial number of control board cached for each port.
+        port_serial_numbers = dict((port, serial_number)
+                                   for serial_number, port in
+                                   self._control_board_ports(app_values)
+                                   .iteritems())
+        most_recent_port = str(app_values['serial_port'])
+        start = time.time()
+
+        # Serial number of most recently connected control board.
+        expected_serial_number = port_serial_numbers.get(most_recent_port)
+        connected = False
+        if comports[0] == most_recent_port:
+            try:
+                self.control_board.connect([most_recent_port], baud_rate)
+            except Exception, exception:
+                logger.warning('Control board not found on most recently '
+                               'connected port (%s): %s', most_recent_port,
+                               exception)
+            else:
+                connected = True
+                serial_number = str(self.control_board.serial_number)
+                if expected_serial_number in (None, serial_number):
+                    return
+                logger.info('Found control board (serial number: %s) on %s, '
+                            'but expected serial number %s.', serial_number,
+                            most_recent_port, expected_serial_number)
+            ports = comports[1:]
+        else:
+            ports = comports
+
+        futures = probe_ports(ports, partial(probe_control_board,
+                                             baud_rate=baud_rate))
+        deadline = time.time() + self.port_probe_timeout_s
+        found = []
+        for port, future in zip(ports, futures):
+            try:
+                serial_number = \
+                    str(future.result(max(0, deadline - time.time())))
+            except Exception, exception:
+                logger.debug('No control board on %s: %s', port, exception)
+                continue
+            logger.info('Found control board (serial number: %s) on %s in '
+                        '%.2f s.', serial_number, port, time.time() - start)
+            found.append((port, serial_number))
+
+        if connected:
+            # Connected to most recently connected port, but a control board
+            # with a different serial number was found.  Switch to the port of
+            # the expected control board (if found).
+            for port, serial_number in found:
+                if serial_number == expected_serial_number:
+                    self.control_board.disconnect()
+                    self.control_board.connect([port], baud_rate)
+                    return
+            return
+
+        # Wait for timed out probes to close their ports.
+        deadline = time.time() + self.port_probe_timeout_s
+        closed_ports = []
+        for port, future in zip(ports, futures):
+            try:
+                future.result(max(0, deadline - time.time()))
+            except RuntimeError:
+                if not future.done():
+                    logger.warning('Timed out probing %s.', port)
+                    continue
+            except Exception:
+                pass
+            closed_ports.append(port)
+
+        # Prefer a control board with the expected serial number (i.e., the
+        # most recently connected control board, or the control board cached
+        # for the port).
+        found_ports = sorted([port for port, serial_number in found],
+                             key=lambda port: dict(found)[port] not in
+                             (expected_serial_number,
+                              port_serial_numbers.get(port)))
+        # Fall back to connecting to remaining ports one-by-one (e.g., a
+        # probe failed, but a control board may still be found).
+        fallback_ports = found_ports + [port for port in closed_ports
+                                        if port not in found_ports]
+        if not fallback_ports:
+            raise IOError('No control board found while probing ports: %s' %
+                          ', '.join(ports))
+        self.control_board.connect(fallback_ports, baud_rate)
+
     def _update_watchdog(self, enabled):
         try:
             if enabled:
@@ -850,7 +2075,10 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
     def _callback_reset_watchdog(self):
         # only reset the watchdog if we are connected and not waiting for a
         # reply
-        if self.control_board.connected():
+        if self.hardware.busy():
+            logger.debug("Don't reset watchdog. Waiting for hardware request "
+                         "to complete.")
+        elif self.control_board.connected():
             waiting_for_reply = self.control_board.waiting_for_reply()
             if not waiting_for_reply:
                 logger.debug('Reset watchdog')
@@ -880,12 +2108,13 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
         '''
         try:
             self.connect()
-            name = self.control_board.name()
+            device_info = self.get_device_info()
+            name = device_info.name
             if name != "Arduino DMF Controller":
                 raise Exception("Device is not an Arduino DMF Controller")
 
             host_software_version = self.control_board.host_software_version()
-            remote_software_version = self.control_board.software_version()
+            remote_software_version = device_info.software_version
 
             @gtk_threadsafe
             def _firmware_update_prompt():
@@ -904,6 +2133,7 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
 
         self.update_connection_status()
 
+    @deferred_while_hardware_busy
     def on_flash_firmware(self, widget=None, data=None):
         '''
         .. versionchanged:: 2.3.3
@@ -918,10 +2148,13 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                 self.save_config_dialog()
             try:
                 hardware_version =\
-                    utility.Version.fromstring(self.control_board
-                                               .hardware_version())
+                    utility.Version.fromstring(self.get_device_info()
+                                               .hardware_version)
                 if not connected:
                     self.control_board.disconnect()
+                self.waveform.invalidate()
+                self.device_info = None
+                self.control_board.invalidate_cache()
                 self.control_board.flash_firmware(hardware_version)
                 app.main_window_controller.info("Firmware updated "
                                                 "successfully.",
@@ -936,6 +2169,7 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
             self.connect()
         _config_save_prompt_and_flash()
 
+    @deferred_while_hardware_busy
     def load_config_dialog(self):
         '''
         Load control-board device configuration from file, including values set
@@ -978,11 +2212,17 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                              'YAML-encoded file.')
             else:
                 self.control_board.write_config(config)
+                # Configuration (e.g., amplifier gain) affects the waveform.
+                self.waveform.invalidate()
+                self.control_board.invalidate_cache()
+                self._update_device_info()
+                self.amplifier_gains.clear()
                 message = ('Successfully wrote persistent configuration '
                            'settings to control-board.')
                 logger.info(message)
                 info_dialog(message)
 
+    @deferred_while_hardware_busy
     def save_config_dialog(self):
         '''
         Save control-board device configuration, including values set during
@@ -1046,6 +2286,7 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
 # [3]: http://microfluidics.utoronto.ca'''.strip()
             print >> output, config_str
 
+    @deferred_while_hardware_busy
     def on_edit_configuration(self, widget=None, data=None):
         '''
         Display a dialog to manually edit the configuration settings for the
@@ -1064,7 +2305,7 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
             return
 
         hardware_version = utility.Version.fromstring(
-            self.control_board.hardware_version())
+            self.get_device_info().hardware_version)
 
         schema_entries = []
         settings = {}
@@ -1208,12 +2449,22 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                                 self.control_board.set_series_capacitance(
                                     channel, v / 1e12,
                                     resistor_index=series_resistor)
+                # Configuration (e.g., amplifier gain) affects the waveform.
+                self.waveform.invalidate()
+                self.control_board.invalidate_cache()
+                self._update_device_info()
+                self.amplifier_gains.clear()
                 if get_app().protocol:
                     self.on_step_run()
         _edit_config_dialog()
 
+    @deferred_while_hardware_busy
     def on_reset_configuration_to_default_values(self, widget=None, data=None):
         self.control_board.reset_config_to_defaults()
+        self.waveform.invalidate()
+        self.control_board.invalidate_cache()
+        self._update_device_info()
+        self.amplifier_gains.clear()
 
     def update_connection_status(self):
         '''
@@ -1224,15 +2475,18 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
         self.connection_status = "Not connected"
         app = get_app()
         connected = self.control_board.connected()
-        if connected:
-            name = self.control_board.name()
-            version = self.control_board.hardware_version()
-            firmware = self.control_board.software_version()
-            n_channels = self.control_board.number_of_channels()
-            serial_number = self.control_board.serial_number
+        if not connected:
+            # Control board was disconnected.
+            self.device_info = None
+        else:
+            device_info = self.get_device_info()
             self.connection_status = ('%s v%s (Firmware: %s, S/N %03d)\n%d '
-                                      'channels' % (name, version, firmware,
-                                                    serial_number, n_channels))
+                                      'channels' %
+                                      (device_info.name,
+                                       device_info.hardware_version,
+                                       device_info.software_version,
+                                       device_info.serial_number,
+                                       device_info.number_of_channels))
 
         @gtk_threadsafe
         def _update_ui_connected_status():
@@ -1253,11 +2507,12 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
             code runs in the main GTK thread.
         '''
         app = get_app()
+        V_actuation = results.V_actuation()
 
         @gtk_threadsafe
         def _update_ui_impedance():
             label = (self.connection_status + ', Voltage: %.1f V' %
-                     results.V_actuation()[-1])
+                     V_actuation[-1])
 
             # add normalized force to the label if we've calibrated the device
             if results.calibration._c_drop:
@@ -1276,18 +2531,19 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
         logger.info('[DMFControlBoardPlugin]'
                     '.on_device_impedance_update():')
         logger.info('\tset_voltage=%.1f, measured_voltage=%.1f, '
-                    'error=%.1f%%', voltage, results.V_actuation()[-1], 100 *
-                    (results.V_actuation()[-1] - voltage) / voltage)
+                    'error=%.1f%%', voltage, V_actuation[-1], 100 *
+                    (V_actuation[-1] - voltage) / voltage)
 
         # check that the signal is within tolerance
-        if (abs(results.V_actuation()[-1] - voltage) >
+        if (abs(V_actuation[-1] - voltage) >
                 self.control_board.voltage_tolerance):
 
             # if the signal is less than the voltage tolerance
-            if results.V_actuation()[-1] < self.control_board.voltage_tolerance:
+            if V_actuation[-1] < self.control_board.voltage_tolerance:
                 if self.control_board.auto_adjust_amplifier_gain:
                     # reset the amplifier gain to a high value
                     self.control_board.amplifier_gain = 300
+                    self.waveform.voltage = None
                 error_msg = ("Low voltage detected. Please check that the "
                              "amplifier is on.")
                 logger.error(error_msg)
@@ -1299,6 +2555,9 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                     self.n_voltage_adjustments < 5):
                 logger.info('\tn_voltage_adjustments=%d',
                             self.n_voltage_adjustments)
+                # The amplifier gain was adjusted during the measurement, so
+                # the voltage must be re-applied even though it is unchanged.
+                self.waveform.voltage = None
                 emit_signal("set_voltage", voltage,
                             interface=IWaveformGenerator)
                 self.check_impedance(options, self.n_voltage_adjustments + 1)
@@ -1309,6 +2568,12 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                     logger.info('Voltage tolerance exceeded!')
                 else:
                     logger.warning('Failed to achieve the specified voltage.')
+        elif self.control_board.auto_adjust_amplifier_gain:
+            # Voltage is within tolerance, so remember the amplifier gain for
+            # the current frequency (see `_stabilize_amplifier_gain`).
+            self.amplifier_gains.set(results.frequency,
+                                     self.get_actuated_area(),
+                                     self.control_board.amplifier_gain)
 
         if (self.control_board.auto_adjust_amplifier_gain and not
                 self.amplifier_gain_initialized):
@@ -1319,6 +2584,7 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
     def get_actuated_area(self):
         return self.actuated_area
 
+    @deferred_while_hardware_busy
     def on_step_run(self):
         """
         Handler called whenever a step is executed.
@@ -1348,12 +2614,9 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                                 interface=IWaveformGenerator)
                     self.check_impedance(options)
 
-                max_channels = self.control_board.number_of_channels()
-                # All channels should default to off.
-                channel_states = np.zeros(max_channels, dtype=int)
-                # Set the state of any channels that have been set explicitly.
-                channel_states[self.channel_states.index
-                               .values.tolist()] = self.channel_states
+                channel_states = self._channel_states_array()
+                # Channel states are applied by every branch below.
+                self.channel_states.dirty = False
 
                 if feedback_options.feedback_enabled:
                     if feedback_options.action.__class__ == RetryAction:
@@ -1375,10 +2638,11 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                                            .increase_voltage * attempt)
                             emit_signal("set_voltage", voltage,
                                         interface=IWaveformGenerator)
-                            if frequency != self.current_frequency:
+                            if not self.waveform.frequency_matches(frequency):
                                 emit_signal("set_frequency", frequency,
                                             interface=IWaveformGenerator)
-                                self.check_impedance(options)
+                                self._stabilize_amplifier_gain(options,
+                                                               voltage)
                             self.measure_impedance_non_blocking(
                                 app_values['sampling_window_ms'],
                                 int(math.ceil(options.duration /
@@ -1426,12 +2690,13 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                                                feedback_options.action
                                                .n_voltage_steps).tolist()
                         frequency = options.frequency
-                        if frequency != self.current_frequency:
+                        if not self.waveform.frequency_matches(frequency):
                             emit_signal("set_voltage", options.voltage,
                                         interface=IWaveformGenerator)
                             emit_signal("set_frequency", frequency,
                                         interface=IWaveformGenerator)
-                            self.check_impedance(options)
+                            self._stabilize_amplifier_gain(options,
+                                                           options.voltage)
                         results = FeedbackResultsSeries('Voltage')
                         test_options = deepcopy(options)
                         self._callback_sweep_voltage(test_options,
@@ -1447,14 +2712,17 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                     emit_signal("set_voltage", options.voltage,
                                 interface=IWaveformGenerator)
                     self.check_impedance(options)
-                    self.control_board.state_of_all_channels = channel_states
+                    self.set_state_of_all_channels(channel_states)
+                    self._realtime_waveform = (options.voltage,
+                                               options.frequency)
             # Turn off all electrodes if we're not in realtime mode and not
             # running a protocol.
             elif (self.control_board.connected() and not app.realtime_mode and
                   not app.running):
                 logger.info('Turning off all electrodes.')
-                self.control_board.set_state_of_all_channels(
-                    np.zeros(self.control_board.number_of_channels()))
+                self.set_state_of_all_channels(
+                    np.zeros(self.get_device_info().number_of_channels))
+                self.channel_states.dirty = True
 
             # if a protocol is running, wait for the specified minimum duration
             if app.running:
@@ -1498,6 +2766,50 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
         self.step_complete()
         return False  # stop the timeout from refiring
 
+    def _store_feedback_results(self, log, results):
+        '''
+        Write feedback results to the store selected by the
+        ``feedback_results_storage`` app option.
+
+        Parameters
+        ----------
+        log : microdrop.experiment_log.ExperimentLog
+            Experiment log.
+        results : dmf_control_board_firmware.FeedbackResults
+            Feedback results for the last step in :data:`log`.
+
+        Returns
+        -------
+        dmf_control_board_firmware.FeedbackResults or
+        .results_store.FeedbackResultsRef
+            Object to add to the experiment log, i.e., either
+            :data:`results` (to be pickled with the experiment log) or a
+            reference to the results in the store (stored in the experiment
+            log directory, see :func:`bind_experiment_log_feedback_results`).
+
+        .. versionadded:: 2.4.0
+        '''
+        storage = self.get_app_values().get('feedback_results_storage')
+        store_type = FEEDBACK_RESULTS_STORES.get(storage)
+        if store_type is None:
+            return results
+        store_class, filename = store_type
+        log_dir = experiment_log_directory(log)
+        store_path = log_dir.joinpath(filename)
+        if (not isinstance(self.feedback_results_store, store_class) or
+                self.feedback_results_store.root != store_path):
+            # References to the store hold the path of the store relative to
+            # the experiment log directory.
+            self.feedback_results_store = store_class(log_dir, filename)
+        try:
+            return self.feedback_results_store.append(len(log.data) - 1,
+                                                      results)
+        except Exception:
+            logger.error('Error writing feedback results to `%s`; adding '
+                         'results to experiment log instead.', store_path,
+                         exc_info=True)
+            return results
+
     def _callback_retry_action_completed(self, options):
         logger.debug('[DMFControlBoardPlugin] '
                      '_callback_retry_action_completed')
@@ -1507,7 +2819,15 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
         results = self.get_measure_impedance_data()
         logger.debug("V_actuation=%s" % results.V_actuation())
         logger.debug("Z_device=%s" % results.Z_device())
-        app.experiment_log.add_data({"FeedbackResults": results}, self.name)
+        app.experiment_log.add_data({"FeedbackResults":
+                                     self._store_feedback_results(
+                                         app.experiment_log, results)},
+                                    self.name)
+        try:
+            self.step_summary.add(app.experiment_log, results)
+        except Exception:
+            logger.debug('Error updating step summary.', exc_info=True)
+            self.step_summary.reset()
 
         normalized_capacitance = np.ma.masked_invalid(results.capacitance() /
                                                       area)
@@ -1637,11 +2957,12 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
         self._voltage_tolerance_error_flag = False
         if not self.control_board.connected():
             logger.warning("Warning: no control board connected.")
-        elif (self.control_board.number_of_channels() <=
+        elif (self.get_device_info().number_of_channels <=
               app.dmf_device.max_channel()):
             logger.warning("Warning: currently connected board does not have "
                            "enough channels for this protocol.")
 
+    @deferred_while_hardware_busy
     def on_protocol_pause(self):
         """
         Handler called when a protocol is paused.
@@ -1651,11 +2972,14 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
         if self.control_board.connected() and not app.realtime_mode:
             # Turn off all electrodes
             logger.debug('Turning off all electrodes.')
-            self.control_board.set_state_of_all_channels(
-                np.zeros(self.control_board.number_of_channels()))
+            self.set_state_of_all_channels(
+                np.zeros(self.get_device_info().number_of_channels))
+            self.channel_states.dirty = True
             if self._voltage_tolerance_error_flag:
                 logger.warning('Some steps in the protocol failed to achieve '
                                'the specified voltage.')
+        logger.info('Channel state writes: %(issued)d issued, %(skipped)d '
+                    'skipped', self.channel_writes.counts())
 
     def on_experiment_log_selection_changed(self, data):
         """
@@ -1663,37 +2987,133 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
 
         Parameters:
             data : dictionary of experiment log data for the selected steps
+
+        .. versionchanged:: 2.4.0
+            Keep selection for feedback results controller, which may not be
+            created yet (see :meth:`get_feedback_results_controller`), and
+            resolve stored feedback results of the selected experiment log
+            relative to the experiment log directory (see
+            :func:`bind_experiment_log_feedback_results`).
         """
+        try:
+            experiment_log_controller = get_service_instance_by_name(
+                "microdrop.gui.experiment_log_controller", "microdrop")
+            bind_experiment_log_feedback_results(experiment_log_controller
+                                                 .results.log)
+        except Exception:
+            logger.debug('Error resolving stored feedback results of selected '
+                         'experiment log.', exc_info=True)
+        self.experiment_log_selection = data
         if self.feedback_results_controller:
             self.feedback_results_controller. \
                 on_experiment_log_selection_changed(data)
 
+    def get_feedback_results_controller(self):
+        '''
+        Returns
+        -------
+        FeedbackResultsController
+            Feedback results controller, created (i.e., window and plot are
+            built) on first call.
+
+        .. versionadded:: 2.4.0
+        '''
+        if self.feedback_results_controller is None:
+            self.feedback_results_controller = FeedbackResultsController(self)
+            self.feedback_results_controller\
+                .on_experiment_log_selection_changed(
+                    self.experiment_log_selection)
+        return self.feedback_results_controller
+
+    def get_feedback_calibration_controller(self):
+        '''
+        Returns
+        -------
+        FeedbackCalibrationController
+            Feedback calibration controller, created on first call.
+
+        .. versionadded:: 2.4.0
+        '''
+        if self.feedback_calibration_controller is None:
+            self.feedback_calibration_controller = \
+                FeedbackCalibrationController(self)
+        return self.feedback_calibration_controller
+
+    def set_state_of_all_channels(self, states):
+        '''
+        Write the state of every channel to the control board, unless the
+        states match the states most recently written.
+
+        Parameters
+        ----------
+        states : array-like
+            State of each channel on the control board.
+
+        Returns
+        -------
+        bool
+            ``True`` if the states were written to the control board.
+
+        .. versionadded:: 2.4.0
+        '''
+        if not self.channel_writes.needs_write(states):
+            logger.debug('[DMFControlBoardPlugin] set_state_of_all_channels: '
+                         'states unchanged, skip write')
+            return False
+        self.control_board.set_state_of_all_channels(states)
+        self.channel_writes.record(states)
+        return True
+
+    @deferred_while_hardware_busy
     def set_voltage(self, voltage):
         """
         Set the waveform voltage.
 
+        The serial command is skipped if the voltage matches the voltage
+        most recently applied.
+
         Parameters:
             voltage : RMS voltage
         """
         logger.info("[DMFControlBoardPlugin].set_voltage(%.1f)" % voltage)
+        if self.waveform.voltage_matches(voltage):
+            logger.debug('[DMFControlBoardPlugin] set_voltage: voltage '
+                         'unchanged, skip write')
+            return
+        self._realtime_waveform = None
         self.control_board.set_waveform_voltage(voltage)
+        self.waveform.voltage = voltage
 
+    @deferred_while_hardware_busy
     def set_frequency(self, frequency):
         """
         Set the waveform frequency.
 
+        The serial command is skipped if the frequency matches the frequency
+        most recently applied.
+
         Parameters:
             frequency : frequency in Hz
         """
         logger.info("[DMFControlBoardPlugin].set_frequency(%.1f)" % frequency)
+        if self.waveform.frequency_matches(frequency):
+            logger.debug('[DMFControlBoardPlugin] set_frequency: frequency '
+                         'unchanged, skip write')
+            return
+        self._realtime_waveform = None
         self.control_board.set_waveform_frequency(frequency)
-        self.current_frequency = frequency
+        self.waveform.frequency = frequency
 
     def check_impedance(self, options, n_voltage_adjustments=0):
         """
         Check the device impedance.
 
         Note that this function blocks until it returns.
+
+        .. versionchanged:: 2.4.0
+            The measurement is performed in the hardware worker thread and
+            GTK events continue to be processed until it completes (see
+            :meth:`wait_for_hardware`).
         """
         # increment the number of adjustment attempts
         self.n_voltage_adjustments = n_voltage_adjustments
@@ -1714,7 +3134,7 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                 delay_between_windows_ms,
                 app_values['interleave_feedback_samples'],
                 app_values['use_rms'],
-                np.zeros(self.control_board.number_of_channels(), dtype=int))
+                np.zeros(self.get_device_info().number_of_channels, dtype=int))
         try:
             emit_signal("on_device_impedance_update", results)
         except ValueError, exception:
@@ -1724,6 +3144,39 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                 self.step_complete('Fail')
         return results
 
+    def _stabilize_amplifier_gain(self, options, voltage):
+        '''
+        Stabilize the amplifier gain after a change of waveform frequency.
+
+        If an amplifier gain has already been learned for the waveform
+        frequency (see :meth:`on_device_impedance_update`), restore the gain
+        and re-apply the voltage.  Otherwise, fall back to the blocking
+        :meth:`check_impedance`.
+
+        Parameters
+        ----------
+        options : DMFControlBoardOptions
+            Step options.
+        voltage : float
+            Waveform voltage (RMS) for the step.
+
+        .. versionadded:: 2.4.0
+        '''
+        gain = None
+        if self.control_board.auto_adjust_amplifier_gain:
+            gain = self.amplifier_gains.get(options.frequency,
+                                            self.get_actuated_area())
+        if gain is None:
+            self.check_impedance(options)
+            return
+        logger.info('[DMFControlBoardPlugin] _stabilize_amplifier_gain: use '
+                    'cached gain=%.1f for frequency=%.1f', gain,
+                    options.frequency)
+        self.control_board.amplifier_gain = gain
+        # Voltage must be re-applied for the restored gain to take effect.
+        self.waveform.voltage = None
+        emit_signal("set_voltage", voltage, interface=IWaveformGenerator)
+
     def _check_n_sampling_windows(self,
                                   sampling_window_ms,
                                   n_sampling_windows,
@@ -1770,6 +3223,8 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                                            n_sampling_windows,
                                            delay_between_windows_ms)
 
+        # The measurement applies its own channel states.
+        self.channel_writes.invalidate()
         self.control_board.measure_impedance_non_blocking(
                                              sampling_window_ms,
                                              n_sampling_windows,
@@ -1793,13 +3248,98 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                                            n_sampling_windows,
                                            delay_between_windows_ms)
 
-        return self.control_board.measure_impedance(
-                                             sampling_window_ms,
-                                             n_sampling_windows,
-                                             delay_between_windows_ms,
-                                             interleave_samples,
-                                             rms,
-                                             state)
+        # The measurement applies its own channel states.
+        self.channel_writes.invalidate()
+        # Perform the measurement in the hardware worker thread, while
+        # continuing to process GTK events.
+        return self.wait_for_hardware(self.hardware
+                                      .submit(self.control_board
+                                              .measure_impedance,
+                                              sampling_window_ms,
+                                              n_sampling_windows,
+                                              delay_between_windows_ms,
+                                              interleave_samples, rms, state))
+
+    def wait_for_hardware(self, future):
+        '''
+        Wait for a hardware request to complete, while continuing to process
+        GTK events (see :func:`hardware.gtk_wait`).
+
+        Events that may modify the state of the control board are **not**
+        handled re-entrantly while waiting, since the caller may, for
+        example, be part way through applying a step.  Instead, handlers
+        that write to the control board (see
+        :func:`deferred_while_hardware_busy`) and 0MQ messages (see
+        :meth:`DmfZmqPlugin.check_sockets`) are deferred and handled once the
+        caller has returned to the main loop.
+
+        Parameters
+        ----------
+        future : hardware.HardwareFuture
+
+        Returns
+        -------
+        object
+            Result of the request.
+
+        .. versionadded:: 2.4.0
+        '''
+        self.hardware_waits += 1
+        try:
+            return gtk_wait(future)
+        finally:
+            self.hardware_waits -= 1
+            if not self.hardware_waits:
+                gobject.idle_add(self._callback_resume_deferred)
+
+    def _defer_call(self, method, args, kwargs):
+        '''
+        Defer a call to a handler that writes to the control board (see
+        :func:`deferred_while_hardware_busy`).
+
+        Returns
+        -------
+        bool
+            ``True`` if the call was deferred, i.e., if the plugin is waiting
+            for a hardware request, the hardware worker is busy, or other
+            calls are already deferred (to preserve the order of calls).
+
+        .. versionadded:: 2.4.0
+        '''
+        if not (self.hardware_waits or self.hardware.busy() or
+                (self._deferred_calls and not self._resuming_deferred)):
+            return False
+        logger.debug('[DMFControlBoardPlugin] hardware busy, defer %s()',
+                     method.__name__)
+        self._deferred_calls.append((method, args, kwargs))
+        if not self.hardware_waits:
+            # Otherwise, deferred calls are resumed by `wait_for_hardware`.
+            self.hardware.add_idle_callback(self._callback_resume_deferred)
+        return True
+
+    def _callback_resume_deferred(self):
+        if self.hardware_waits or self._resuming_deferred:
+            # Waiting for another hardware request, which resumes deferred
+            # events once complete.
+            return False
+        self._resuming_deferred = True
+        try:
+            while self._deferred_calls:
+                if self.hardware.busy():
+                    self.hardware\
+                        .add_idle_callback(self._callback_resume_deferred)
+                    return False
+                method, args, kwargs = self._deferred_calls.pop(0)
+                try:
+                    method(self, *args, **kwargs)
+                except Exception:
+                    logger.error('Error in deferred call to `%s`.',
+                                 method.__name__, exc_info=True)
+        finally:
+            self._resuming_deferred = False
+        if self.plugin is not None:
+            self.plugin.resume_sockets()
+        return False  # Stop the idle callback from refiring
 
     def get_default_step_options(self):
         return DMFControlBoardOptions()
@@ -1883,6 +3423,17 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                                      get_app().protocol.current_step_number)
 
     def on_experiment_log_changed(self, log):
+        '''
+        .. versionchanged:: 2.4.0
+            Reset step summary (see :class:`FeedbackResultsStepSummary`) for
+            new experiment log.  Resolve stored feedback results relative to
+            the experiment log directory (see
+            :func:`bind_experiment_log_feedback_results`).
+        '''
+        if log.experiment_id != self.step_summary.experiment_id:
+            self.step_summary.reset(log.experiment_id)
+        bind_experiment_log_feedback_results(log)
+
         # Check if the experiment log already has control board meta data, and
         # if so, return.
         data = log.get("control board name")
@@ -1894,13 +3445,13 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
         # and firmware version
         data = {}
         if self.control_board.connected():
-            data["control board name"] = self.control_board.name()
-            data["control board serial number"] = \
-                self.control_board.serial_number
-            data["control board hardware version"] = (self.control_board
-                                                      .hardware_version())
-            data["control board software version"] = (self.control_board
-                                                      .software_version())
+            device_info = self.get_device_info()
+            data["control board name"] = device_info.name
+            data["control board serial number"] = device_info.serial_number
+            data["control board hardware version"] = \
+                device_info.hardware_version
+            data["control board software version"] = \
+                device_info.software_version
             # add info about the devices on the i2c bus
             try:
                 data["i2c devices"] = (self.control_board._i2c_devices)
@@ -1908,11 +3459,57 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
                 pass
         log.add_data(data)
 
+    def on_export_log_feedback_results(self, widget, data=None):
+        '''
+        Prompt for an output path and export feedback results of the
+        experiment log currently selected in the experiment log controller to
+        HDF5 (see :func:`export_experiment_log_feedback_results_hdf`).
+
+        .. versionadded:: 2.4.0
+        '''
+        experiment_log_controller = get_service_instance_by_name(
+            "microdrop.gui.experiment_log_controller", "microdrop")
+        log = experiment_log_controller.results.log
+
+        dialog = gtk.FileChooserDialog(title="Export feedback results",
+                                       action=gtk.FILE_CHOOSER_ACTION_SAVE,
+                                       buttons=(gtk.STOCK_CANCEL,
+                                                gtk.RESPONSE_CANCEL,
+                                                gtk.STOCK_SAVE,
+                                                gtk.RESPONSE_OK))
+        dialog.set_default_response(gtk.RESPONSE_OK)
+        dialog.set_do_overwrite_confirmation(True)
+        dialog.set_current_name('feedback_results-%s.h5' % log.experiment_id)
+        response = dialog.run()
+        h5_path = path(dialog.get_filename())
+        dialog.destroy()
+        if response != gtk.RESPONSE_OK:
+            return
+
+        try:
+            row_count = export_experiment_log_feedback_results_hdf(log,
+                                                                   h5_path)
+        except Exception:
+            logger.error('Error exporting feedback results to `%s`.', h5_path,
+                         exc_info=True)
+        else:
+            logger.info('Exported %d feedback result rows to `%s`.', row_count,
+                        h5_path)
+
     def on_export_experiment_log_data(self, log):
+        '''
+        .. versionchanged:: 2.4.0
+            Use step summary computed while the protocol was running, if it
+            covers every step of the log.
+        '''
         feedback_results_df = \
             microdrop_experiment_log_to_feedback_results_df(log)
-        step_summary_df =\
-            feedback_results_df_to_step_summary_df(feedback_results_df)
+        results = bind_experiment_log_feedback_results(log)
+        if self.step_summary.covers(log, results):
+            step_summary_df = self.step_summary.to_frame()
+        else:
+            step_summary_df =\
+                feedback_results_df_to_step_summary_df(feedback_results_df)
         data = {}
         data['feedback results'] = feedback_results_df
         data['step summary'] = step_summary_df
@@ -1955,7 +3552,8 @@ class DMFControlBoardPlugin(Plugin, StepOptionsController, AppDataController):
 
     def _file_prefix(self):
         timestamp = datetime.now().strftime('%Y-%m-%dT%Hh%Mm%S')
-        return '[%05d]-%s-' % (self.control_board.serial_number, timestamp)
+        return '[%05d]-%s-' % (self.get_device_info().serial_number,
+                               timestamp)
 
 
 PluginGlobals.pop_env()
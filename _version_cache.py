@@ -0,0 +1,191 @@
+"""
+Copyright 2017 Ryan Fobel and Christian Fobel
+
+This file is part of dmf_control_board.
+
+dmf_control_board is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+dmf_control_board is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with dmf_control_board.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import os
+
+from ._version import NotThisMethod, get_versions as _get_versions
+
+
+#: Name of file (in plugin directory) caching version information.
+VERSION_CACHE_FILE = '_version_cache.json'
+
+
+def git_dir(root):
+    '''
+    Parameters
+    ----------
+    root : str
+        Root of source tree.
+
+    Returns
+    -------
+    str
+        Path to git directory of source tree.
+
+    Raises
+    ------
+    NotThisMethod
+        If source tree is not a git work tree.
+    '''
+    git_dir_ = os.path.join(root, '.git')
+    if os.path.isfile(git_dir_):
+        # Linked work tree or submodule, e.g., `gitdir: ../.git/modules/foo`.
+        with open(git_dir_) as f:
+            contents = f.read().strip()
+        if not contents.startswith('gitdir: '):
+            raise NotThisMethod('unrecognized .git file')
+        git_dir_ = os.path.join(root, contents[len('gitdir: '):])
+    if not os.path.isfile(os.path.join(git_dir_, 'HEAD')):
+        raise NotThisMethod('no .git/HEAD')
+    return git_dir_
+
+
+def git_cache_key(root):
+    '''
+    Parameters
+    ----------
+    root : str
+        Root of source tree.
+
+    Returns
+    -------
+    list
+        Modification times of git files that determine the version, i.e.,
+        ``HEAD``, the ref ``HEAD`` points to, ``packed-refs``, the tags
+        directory (new tags), and the index (so the dirty flag is refreshed
+        whenever the index is updated).
+
+        Note that the work tree is not checked (to avoid touching every file
+        at import), so edits that are not staged do not refresh the dirty
+        flag.
+
+    Raises
+    ------
+    NotThisMethod
+        If source tree is not a git work tree.
+    EnvironmentError
+        If git files could not be read.
+    '''
+    git_dir_ = git_dir(root)
+    names = ['HEAD', 'packed-refs', os.path.join('refs', 'tags'), 'index']
+    with open(os.path.join(git_dir_, 'HEAD')) as f:
+        contents = f.read().strip()
+    if contents.startswith('ref: '):
+        names.append(contents[len('ref: '):])
+
+    key = []
+    for name in names:
+        try:
+            mtime = os.stat(os.path.join(git_dir_, name)).st_mtime
+        except OSError:
+            mtime = None
+        key.append([name, mtime])
+    return key
+
+
+def versions_from_cache(root, key):
+    '''
+    Parameters
+    ----------
+    root : str
+        Root of source tree.
+    key : list
+        Cache key (see :func:`git_cache_key`).
+
+    Returns
+    -------
+    dict
+        Version information cached by :func:`write_versions_cache`.
+
+    Raises
+    ------
+    NotThisMethod
+        If there is no cache or if the cache was written for a different key.
+    '''
+    try:
+        with open(os.path.join(root, VERSION_CACHE_FILE)) as f:
+            cache = json.load(f)
+    except (EnvironmentError, ValueError):
+        raise NotThisMethod('no version cache')
+    if cache.get('key') != key:
+        raise NotThisMethod('version cache is stale')
+    # Values are loaded as `unicode`.
+    return dict((str(k), v if v is None or isinstance(v, bool) else str(v))
+                for k, v in cache['versions'].iteritems())
+
+
+def write_versions_cache(root, key, versions):
+    '''
+    Cache version information for :func:`versions_from_cache`.
+
+    Parameters
+    ----------
+    root : str
+        Root of source tree.
+    key : list
+        Cache key (see :func:`git_cache_key`).
+    versions : dict
+        Version information (see :func:`_version.get_versions`).
+
+    Raises
+    ------
+    EnvironmentError
+        If cache could not be written (e.g., read-only source tree).
+    '''
+    with open(os.path.join(root, VERSION_CACHE_FILE), 'w') as f:
+        json.dump({'key': key, 'versions': versions}, f)
+
+
+def get_versions():
+    '''
+    Get version information, using the cache from a previous `git` query if
+    the source tree has not changed since.
+
+    Wraps :func:`_version.get_versions`, which is generated by `versioneer`
+    and **MUST NOT** be modified.  Any error reading or writing the cache
+    falls back to :func:`_version.get_versions`.
+
+    Returns
+    -------
+    dict
+        Version information (see :func:`_version.get_versions`).
+
+    .. versionadded:: 2.4.0
+    '''
+    root = os.path.dirname(os.path.realpath(__file__))
+    try:
+        key = git_cache_key(root)
+    except (NotThisMethod, EnvironmentError):
+        # Not a git work tree (e.g., installed from a release archive).
+        return _get_versions()
+
+    try:
+        return versions_from_cache(root, key)
+    except NotThisMethod:
+        pass
+
+    versions = _get_versions()
+    if versions.get('error') is None:
+        try:
+            # `git describe --dirty` may refresh the index, so get the key
+            # again after querying `git`.
+            write_versions_cache(root, git_cache_key(root), versions)
+        except (NotThisMethod, EnvironmentError):
+            pass
+    return versions
@@ -0,0 +1,138 @@
+"""
+Copyright 2017 Ryan Fobel and Christian Fobel
+
+This file is part of dmf_control_board.
+
+dmf_control_board is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+dmf_control_board is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with dmf_control_board.  If not, see <http://www.gnu.org/licenses/>.
+"""
+# Benchmark conversion of the feedback results in an experiment log to a
+# single data frame (i.e., `microdrop_experiment_log_to_feedback_results_df`)
+# as a function of the number of steps in the log.
+#
+# The current implementation is compared against the original implementation,
+# which appended the frame of each step to the combined frame and computed the
+# timestamp of each sample separately using `arrow`.
+#
+# **N.B.,** the plugin module is imported, so this script **MUST** be run in a
+# MicroDrop environment, e.g.:
+#
+#     python benchmarks/feedback_results_df.py --steps 10 100 1000 --samples 50
+import argparse
+import importlib
+import sys
+import timeit
+
+from path_helpers import path
+import arrow
+import numpy as np
+import pandas as pd
+
+
+def import_plugin():
+    plugin_root = path(__file__).realpath().parent.parent
+    sys.path.insert(0, str(plugin_root.parent))
+    return importlib.import_module(str(plugin_root.name))
+
+
+class SyntheticFeedbackResults(object):
+    '''
+    Stand-in for :class:`dmf_control_board_firmware.FeedbackResults`,
+    providing the data frame of a step.
+    '''
+    def __init__(self, sample_count, sample_period_s=.005):
+        self.df = pd.DataFrame({'step_time': np.arange(sample_count) *
+                                sample_period_s,
+                                'capacitance': np.random.rand(sample_count),
+                                'voltage': 100 + np.random.rand(sample_count),
+                                'force': np.random.rand(sample_count)})\
+            .set_index('step_time')
+
+    def to_frame(self):
+        return self.df
+
+
+class SyntheticExperimentLog(object):
+    '''
+    Stand-in for :class:`microdrop.experiment_log.ExperimentLog`, providing
+    the fields read by the export.
+    '''
+    def __init__(self, step_count, sample_count):
+        self.data = {'FeedbackResults':
+                     [SyntheticFeedbackResults(sample_count)
+                      for i in xrange(step_count)],
+                     'time': np.arange(step_count) * 1.5,
+                     'start time': [arrow.utcnow().timestamp]}
+
+    def get(self, name, plugin_name=None):
+        return self.data[name]
+
+
+def original_feedback_results_df(log):
+    '''
+    Original implementation (i.e., before version 2.4.0).
+    '''
+    results = log.get('FeedbackResults')
+    step_start_time = log.get('time')
+    start_time = arrow.get(log.get('start time')[0])
+
+    feedback_results_df = pd.DataFrame()
+    for i, step in enumerate(results):
+        if step is None:
+            continue
+        df = step.to_frame().reset_index()
+        df.insert(0, 'step_index', i)
+        df.insert(0, 'utc_timestamp', [start_time.replace(
+                    seconds=step_start_time[i] + t).datetime
+                                       for t in df['step_time']])
+        df.set_index('utc_timestamp', inplace=True)
+        feedback_results_df = feedback_results_df.append(df)
+    return feedback_results_df
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark export of '
+                                     'feedback results from an experiment '
+                                     'log vs. number of steps.')
+    parser.add_argument('--steps', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--samples', type=int, default=50,
+                        help='Number of samples per step '
+                        '(default=%(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of repetitions; the fastest is reported '
+                        '(default=%(default)s)')
+    parser.add_argument('--skip-original', action='store_true',
+                        help='Only time the current implementation.')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    plugin = import_plugin()
+
+    print '%8s %12s %14s %14s' % ('steps', 'samples', 'current (s)',
+                                  'original (s)')
+    for step_count in args.steps:
+        log = SyntheticExperimentLog(step_count, args.samples)
+        to_df = plugin.microdrop_experiment_log_to_feedback_results_df
+        current_s = min(timeit.repeat(lambda: to_df(log), number=1,
+                                      repeat=args.repeat))
+        if args.skip_original:
+            original_s = np.nan
+        else:
+            original_s = min(timeit.repeat(lambda:
+                                           original_feedback_results_df(log),
+                                           number=1, repeat=args.repeat))
+        print '%8d %12d %14.3f %14.3f' % (step_count, step_count *
+                                          args.samples, current_s, original_s)
@@ -0,0 +1,101 @@
+"""
+Copyright 2017 Ryan Fobel and Christian Fobel
+
+This file is part of dmf_control_board.
+
+dmf_control_board is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+dmf_control_board is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with dmf_control_board.  If not, see <http://www.gnu.org/licenses/>.
+"""
+# Benchmark import of the plugin module (i.e., the load time of the plugin at
+# MicroDrop startup).
+#
+# Each import is timed in a fresh Python subprocess, and modules that are
+# imported on first use (i.e., plotting and HDF modules) are checked to not be
+# loaded by the import.
+#
+# **N.B.,** the plugin module is imported, so this script **MUST** be run in a
+# MicroDrop environment, e.g.:
+#
+#     python benchmarks/plugin_import.py --repeat 5
+import argparse
+import json
+import subprocess
+import sys
+
+from path_helpers import path
+
+
+#: Modules that **MUST** not be imported when the plugin is loaded.
+LAZY_MODULES = ('matplotlib', 'tables', 'arrow')
+
+#: Imports plugin module and prints import duration (in seconds) and the lazy
+#: modules that were loaded as JSON.
+IMPORT_SCRIPT = '''
+import importlib
+import json
+import sys
+import time
+
+sys.path.insert(0, %(plugin_parent)r)
+start = time.time()
+importlib.import_module(%(plugin_name)r)
+duration_s = time.time() - start
+print json.dumps({'duration_s': duration_s,
+                  'loaded': [name for name in %(lazy_modules)r
+                             if name in sys.modules]})
+'''.strip()
+
+
+def time_plugin_import():
+    '''
+    Returns
+    -------
+    dict
+        Import duration (``duration_s``) and lazy modules loaded by the
+        import (``loaded``).
+    '''
+    plugin_root = path(__file__).realpath().parent.parent
+    script = IMPORT_SCRIPT % {'plugin_parent': str(plugin_root.parent),
+                              'plugin_name': str(plugin_root.name),
+                              'lazy_modules': LAZY_MODULES}
+    output = subprocess.check_output([sys.executable, '-c', script])
+    # Plugin may print to `stdout` while importing, so only parse the last
+    # line.
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark import of the '
+                                     'plugin module in a fresh Python '
+                                     'process.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of repetitions; the fastest is reported '
+                        '(default=%(default)s)')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    results = [time_plugin_import() for i in xrange(args.repeat)]
+    print '%8s %14s' % ('run', 'import (s)')
+    for i, result in enumerate(results):
+        print '%8d %14.3f' % (i, result['duration_s'])
+    print 'fastest: %.3f s' % min(result['duration_s'] for result in results)
+
+    loaded = sorted(set(name for result in results
+                        for name in result['loaded']))
+    if loaded:
+        print >> sys.stderr, ('Modules imported at plugin load: %s' %
+                              ', '.join(loaded))
+        raise SystemExit(1)
@@ -24,19 +24,11 @@ try:
     import cPickle as pickle
 except ImportError:
     import pickle
+import threading
 import warnings
 
 from dmf_control_board_firmware import FeedbackResultsSeries
-from dmf_control_board_firmware.calibrate.hv_attenuator import \
-    plot_feedback_params
-from dmf_control_board_firmware.calibrate.impedance_benchmarks import \
-    plot_stat_summary
 from flatland.schema import String, Form
-from matplotlib.backends.backend_gtkagg import (FigureCanvasGTKAgg as
-                                                FigureCanvasGTK)
-from matplotlib.backends.backend_gtkagg import (NavigationToolbar2GTKAgg as
-                                                NavigationToolbar)
-from matplotlib.figure import Figure
 from microdrop.app_context import get_app
 from microdrop.plugin_helpers import get_plugin_info
 from microdrop.plugin_manager import (emit_signal, IWaveformGenerator, IPlugin,
@@ -49,28 +41,78 @@ from path_helpers import path
 from pygtkhelpers.gthreads import gtk_threadsafe
 import gobject
 import gtk
-import matplotlib
-import matplotlib.mlab as mlab
 import numpy as np
 import pandas as pd
-import tables
 import yaml
 
-from .wizards import (MicrodropImpedanceAssistantView,
-                      MicrodropReferenceAssistantView)
-
 logger = logging.getLogger(__name__)
 
 # Ignore natural name warnings from PyTables [1].
 #
+# Match warning by message (rather than by `tables.NaturalNameWarning`
+# category) to avoid importing PyTables until it is actually used.
+#
 # [1]: https://www.mail-archive.com/pytables-users@lists.sourceforge.net/msg01130.html
-warnings.simplefilter('ignore', tables.NaturalNameWarning)
+warnings.filterwarnings('ignore', message='object name ', module='tables')
 
 
 class AmplifierGainNotCalibrated(Exception):
     pass
 
 
+def decimate_min_max(x, y, x_lim, bin_count):
+    '''
+    Decimate samples to at most two points (minimum and maximum) per bin
+    across the visible x-range.
+
+    Parameters
+    ----------
+    x : array-like
+        Sample x values (sorted in ascending order).
+    y : array-like
+        Sample y values (masked or ``NaN`` values are ignored).
+    x_lim : tuple
+        Visible ``(x_min, x_max)`` range.  The samples immediately outside
+        the range are included so lines extend to the edges of the view.
+    bin_count : int
+        Number of bins (e.g., width of the axis in pixels).
+
+    Returns
+    -------
+    (array, array)
+        Decimated x and y values.  Samples are returned as is (within the
+        visible range) if there are no more than two samples per bin.
+
+    .. versionadded:: 2.4.0
+    '''
+    x = np.asarray(x)
+    y = np.ma.filled(np.ma.asarray(y, dtype=float), np.nan)
+    start, end = np.searchsorted(x, x_lim)
+    start = max(start - 1, 0)
+    end = min(end + 1, x.shape[0])
+    sample_count = end - start
+    bin_count = max(int(bin_count), 1)
+    if sample_count <= 2 * bin_count:
+        return x[start:end], y[start:end]
+
+    # Pad samples to a whole number of bins and find the index of the minimum
+    # and maximum value within each bin.
+    bin_size = int(math.ceil(sample_count / float(bin_count)))
+    bin_count = int(math.ceil(sample_count / float(bin_size)))
+    y_bins = np.empty(bin_count * bin_size)
+    y_bins[:sample_count] = y[start:end]
+    y_bins[sample_count:] = np.nan
+    y_bins = y_bins.reshape(bin_count, bin_size)
+    invalid = np.isnan(y_bins)
+    offsets = np.arange(bin_count) * bin_size
+    i_min = np.where(invalid, np.inf, y_bins).argmin(axis=1) + offsets
+    i_max = np.where(invalid, -np.inf, y_bins).argmax(axis=1) + offsets
+    # Keep the minimum and maximum of each bin in order of x.
+    indexes = np.sort(np.column_stack([i_min, i_max]), axis=1).ravel()
+    indexes = np.minimum(indexes, sample_count - 1) + start
+    return x[indexes], y[indexes]
+
+
 class RetryAction():
     class_version = str(Version(0, 2))
 
@@ -379,11 +421,9 @@ class FeedbackOptionsController():
         step = app.protocol.current_step()
         dmf_options = step.get_data(self.plugin.name)
 
-        max_channels = self.plugin.control_board.number_of_channels()
+        max_channels = self.plugin.get_device_info().number_of_channels
         # All channels should default to off.
-        channel_states = np.zeros(max_channels, dtype=int)
-        # Set the state of any channels that have been set explicitly.
-        channel_states[self.channel_states.index] = self.channel_states
+        channel_states = self.plugin.channel_states.to_array(max_channels)
 
         voltage = dmf_options.voltage
         emit_signal("set_voltage", voltage, interface=IWaveformGenerator)
@@ -427,8 +467,9 @@ class FeedbackOptionsController():
 
         # Turn off all electrodes if we're not in realtime mode.
         if not app.realtime_mode:
-            self.plugin.control_board.set_state_of_all_channels(
-                np.zeros(max_channels, dtype=int))
+            self.plugin.set_state_of_all_channels(np.zeros(max_channels,
+                                                           dtype=int))
+            self.plugin.channel_states.dirty = True
 
         return dict(frequency=results.frequency.tolist(),
                     capacitance=(np.mean(results.capacitance(), 1) / area)
@@ -1113,10 +1154,23 @@ class FeedbackOptionsController():
 
 
 class FeedbackResultsController():
+    '''
+    .. versionchanged:: 2.4.0
+        Import :mod:`matplotlib` when the controller is created (rather than
+        when the module is imported).
+
+    .. versionchanged:: 2.4.0
+        The "Feedback Results" menu item is owned by the plugin, which creates
+        the controller the first time the menu item is activated.
+    '''
     def __init__(self, plugin):
+        from matplotlib.backends.backend_gtkagg import (
+            FigureCanvasGTKAgg as FigureCanvasGTK,
+            NavigationToolbar2GTKAgg as NavigationToolbar)
+        from matplotlib.figure import Figure
+
         self.plugin = plugin
         self.builder = gtk.Builder()
-        app = get_app()
         self.builder.add_from_file(path(__file__).parent
                                    .joinpath('glade',
                                              'feedback_results.glade'))
@@ -1131,12 +1185,6 @@ class FeedbackResultsController():
         self.builder.connect_signals(self)
         self.data = []
 
-        self.feedback_results_menu_item = gtk.MenuItem("Feedback Results")
-        app.main_window_controller.menu_view.append(
-            self.feedback_results_menu_item)
-        self.feedback_results_menu_item.connect("activate",
-                                                self.on_window_show)
-
         self.figure = Figure()
         self.canvas = FigureCanvasGTK(self.figure)
         self.axis = self.figure.add_subplot(111)
@@ -1149,6 +1197,24 @@ class FeedbackResultsController():
         combobox_set_model_from_list(self.combobox_y_axis,
                                      ["Impedance", "Capacitance", "Velocity",
                                       "Voltage", "x-position"])
+        # Plotted data of each step, as `(step, time, columns)` (see
+        # `export_csv()`).
+        self.export_data = []
+        # Lines of each step in "Time" plot, indexed by `(step, time,
+        # id(results))` (see `_update_step_lines()`).
+        self._step_lines = {}
+        self._plot_x_axis = None
+        self._xlim_callback_id = None
+        # Incremented on each plot update (see `update_plot()`) and whenever
+        # cached step lines are cleared or invalidated, to detect stale plot
+        # data.
+        self._plot_generation = 0
+        # Latest plot data preparation request, processed by a single
+        # background thread (see `_plot_worker()`).  Requests that have not
+        # been started yet are replaced by newer requests.
+        self._plot_request = None
+        self._plot_condition = threading.Condition()
+        self._plot_thread = None
         self.combobox_x_axis.set_active(0)
         self.combobox_y_axis.set_active(0)
 
@@ -1212,6 +1278,11 @@ class FeedbackResultsController():
         filter.add_pattern("*.csv")
         dialog.add_filter(filter)
         filter = gtk.FileFilter()
+        filter.set_name("HDF5 (*.h5)")
+        filter.add_pattern("*.h5")
+        filter.add_pattern("*.hdf5")
+        dialog.add_filter(filter)
+        filter = gtk.FileFilter()
         filter.set_name("All files")
         filter.add_pattern("*")
         dialog.add_filter(filter)
@@ -1220,12 +1291,53 @@ class FeedbackResultsController():
             filename = dialog.get_filename()
             logger.info("Exporting to file %s." % filename)
             try:
-                with open(filename, 'w') as f:
-                    f.write("\n".join(self.export_data))
+                if path(filename).ext.lower() in ('.h5', '.hdf5'):
+                    self.export_hdf(filename)
+                else:
+                    self.export_csv(filename)
             except Exception, e:
                 logger.error("Problem exporting file. %s." % e)
         dialog.destroy()
 
+    def export_csv(self, filename):
+        '''
+        Write plotted data to CSV file, with one row per exported quantity
+        for each step.
+
+        .. versionadded:: 2.4.0
+        '''
+        with open(filename, 'w') as f:
+            for step, time_, columns in self.export_data:
+                f.write('step:, %d\n' % (step + 1))
+                f.write('step time (s):, %f\n' % time_)
+                for name, label, values in columns:
+                    f.write(label)
+                    values = np.ma.filled(np.ma.asarray(values, dtype=float),
+                                          np.nan)
+                    np.savetxt(f, values.reshape(1, -1), fmt='%.12g',
+                               delimiter=', ')
+
+    def export_hdf(self, filename):
+        '''
+        Write plotted data to HDF5 file, as a single (columnar) table with one
+        row per sample, indexed by step.
+
+        .. versionadded:: 2.4.0
+        '''
+        with pd.HDFStore(filename, mode='w', complevel=5,
+                         complib='blosc') as store:
+            for step, time_, columns in self.export_data:
+                df = pd.DataFrame(dict((name, np.ma.filled(
+                    np.ma.asarray(values, dtype=float), np.nan))
+                    for name, label, values in columns))
+                df.insert(0, 'step_time', time_)
+                df.insert(0, 'step', step + 1)
+                store.append('feedback_results', df, format='table',
+                             data_columns=['step'], index=False)
+            if 'feedback_results' in store:
+                store.create_table_index('feedback_results',
+                                         columns=['step'])
+
     def on_experiment_log_selection_changed(self, data):
         """
         Handler called whenever the experiment log selection changes.
@@ -1236,27 +1348,444 @@ class FeedbackResultsController():
         self.data = data
         self.update_plot()
 
+    def _clear_plot(self):
+        self.axis.cla()
+        self._step_lines.clear()
+        # Plot data prepared for the cleared lines are stale.
+        self._plot_generation += 1
+        # Clearing the axis may also disconnect its callbacks.
+        if self._xlim_callback_id is not None:
+            self.axis.callbacks.disconnect(self._xlim_callback_id)
+        self._xlim_callback_id = \
+            self.axis.callbacks.connect('xlim_changed', self._on_xlim_changed)
+
+    def _on_xlim_changed(self, axis):
+        if self._step_lines:
+            self._decimate_step_lines()
+            self.canvas.draw_idle()
+
+    def _decimate_step_lines(self, x_lim=None):
+        '''
+        Set data of step lines to the samples of each step, decimated to at
+        most two points per pixel within the visible x-range (see
+        :func:`decimate_min_max`).
+
+        Parameters
+        ----------
+        x_lim : tuple, optional
+            Visible ``(x_min, x_max)`` range (current x-limits of axis by
+            default).
+
+        .. versionadded:: 2.4.0
+        '''
+        if x_lim is None:
+            x_lim = sorted(self.axis.get_xlim())
+        bin_count = self.axis.bbox.width
+        for entry in self._step_lines.itervalues():
+            for line, data in zip(entry['lines'], entry['data']):
+                if data is None:
+                    line.set_data([], [])
+                else:
+                    line.set_data(*decimate_min_max(data[0], data[1], x_lim,
+                                                    bin_count))
+
+    def invalidate_lines(self):
+        '''
+        Force data of cached step lines to be recomputed on the next plot
+        update, e.g., after the calibration of the experiment log changes.
+
+        .. versionadded:: 2.4.0
+        '''
+        for entry in self._step_lines.itervalues():
+            entry['key'] = None
+        # Plot data prepared for the previous line keys are stale.
+        self._plot_generation += 1
+
+    def _time_series(self, results, y_axis, filtered, normalization,
+                     normalization_string):
+        '''
+        Parameters
+        ----------
+        results : dmf_control_board_firmware.FeedbackResults
+            Feedback results for a step.
+        y_axis : str
+            Y-axis quantity (e.g., ``"Impedance"``).
+        filtered : bool
+            If ``True``, return filtered values (if applicable to
+            :data:`y_axis`) along with raw values.
+        normalization : float
+            Area to normalize impedance and capacitance by.
+        normalization_string : str
+            Normalization units label.
+
+        Returns
+        -------
+        (array, array, tuple, list)
+            Tuple containing:
+
+             - x values (time);
+             - y values (filtered, if applicable);
+             - raw ``(x, y)`` values if filtered, otherwise ``None``;
+             - export columns, as ``(name, label, values)`` tuples (see
+               :meth:`export_csv`).
+
+        .. versionadded:: 2.4.0
+        '''
+        def derived(name, **kwargs):
+            return self.plugin.derived_quantities.get(results, name,
+                                                      **kwargs)
+
+        raw = None
+        if y_axis == "Impedance":
+            x = results.time
+            Z = derived('Z_device')
+            y = Z / normalization
+            if filtered:
+                raw = (x, y)
+                y = derived('Z_device', filter_order=3) / normalization
+            columns = [('impedance', 'impedance (Ohms%s):, ' %
+                        normalization_string, Z / normalization)]
+        elif y_axis == "Capacitance":
+            x = results.time
+            C = derived('capacitance')
+            y = C / normalization
+            if filtered:
+                raw = (x, y)
+                y = derived('capacitance', filter_order=2) / normalization
+            columns = [('capacitance', 'capacitance (F%s):,' %
+                        normalization_string, C / normalization)]
+        elif y_axis == "Velocity":
+            if filtered:
+                x, dxdt = derived('dxdt', filter_order=3)
+                # plot the unfiltered (raw) velocity in the same color, but a
+                # lighter shade
+                t, raw_dxdt = derived('dxdt')
+                raw = (t, raw_dxdt * 1000)
+            else:
+                x, dxdt = derived('dxdt')
+            y = dxdt * 1000
+            columns = [('velocity', 'velocity (mm/s):,', y)]
+        elif y_axis == "Voltage":
+            # Only plot values that have a valid fb and hv resistor, and that
+            # have been using the same fb and hv resistor for > 1 consecutive
+            # measurement
+            ind = np.flatnonzero(np.logical_and(
+                np.logical_and(results.fb_resistor != -1,
+                               results.hv_resistor != -1),
+                np.logical_and(
+                    np.concatenate(([0], np.diff(results.fb_resistor))) == 0,
+                    np.concatenate(([0], np.diff(results.hv_resistor))) ==
+                    0)))
+            x = results.time[ind]
+            y = derived('V_actuation')[ind]
+            columns = [('V_actuation', 'V_actuation (V_RMS):,', y)]
+        elif y_axis == "x-position":
+            x = results.time
+            x_pos = derived('x_position')
+            y = x_pos
+            if filtered:
+                raw = (x, x_pos)
+                y = derived('x_position', filter_order=3)
+            columns = [('x_position', 'x-position (mm):,', x_pos)]
+        return x, y, raw, [('time', 'time (ms):, ', x)] + columns
+
+    def _sweep_series(self, results, x_axis, y_axis, normalization,
+                      normalization_string):
+        '''
+        Parameters
+        ----------
+        results : dmf_control_board_firmware.FeedbackResultsSeries
+            Feedback results series for a step.
+        x_axis : str
+            X-axis quantity (``"Frequency"`` or ``"Voltage"``).
+        y_axis : str
+            Y-axis quantity (e.g., ``"Impedance"``).
+        normalization : float
+            Area to normalize impedance and capacitance by.
+        normalization_string : str
+            Normalization units label.
+
+        Returns
+        -------
+        (array, array, array, list)
+            Tuple containing x values, mean and standard deviation of y
+            values, and export columns (see :meth:`_time_series`).
+
+        .. versionadded:: 2.4.0
+        '''
+        def derived(name, **kwargs):
+            return self.plugin.derived_quantities.get(results, name,
+                                                      **kwargs)
+
+        if x_axis == "Frequency":
+            x = results.frequency
+            columns = [('frequency', 'frequency (Hz):, ', x)]
+        else:
+            x = results.voltage
+            columns = [('voltage', 'voltage (Vrms):, ', x)]
+
+        if y_axis == "Impedance":
+            Z = np.ma.masked_invalid(derived('Z_device'))
+            y_mean = np.mean(Z, 1) / normalization
+            y_std = np.std(Z, 1) / normalization
+            columns += [('mean_impedance', 'mean(impedance) (Ohms%s):, ' %
+                         normalization_string, y_mean),
+                        ('std_impedance', 'std(impedance) (Ohms%s):, ' %
+                         normalization_string, y_std)]
+        elif y_axis == "Capacitance":
+            C = np.ma.masked_invalid(derived('capacitance'))
+            y_mean = np.mean(C, 1) / normalization
+            y_std = np.std(C, 1) / normalization
+            columns += [('mean_capacitance', 'mean(capacitance) (F):, ',
+                         y_mean),
+                        ('std_capacitance', 'std(capacitance/area) (F):, '
+                         if x_axis == "Frequency" else
+                         'std(capacitance) (F):, ', y_std)]
+        elif y_axis == "Voltage":
+            V = np.ma.masked_invalid(derived('V_actuation'))
+            y_mean = np.mean(V, 1)
+            y_std = np.std(V, 1)
+            columns += [('mean_V_actuation', 'mean(V_actuation) (Vrms):, ',
+                         y_mean),
+                        ('std_V_actuation', 'std(V_actuation) (Vrms):, ',
+                         y_std)]
+        return x, y_mean, y_std, columns
+
+    def _update_step_lines(self, plot_data):
+        '''
+        Update lines of "Time" plot to match selected steps.
+
+        Lines of each step are cached, keyed by ``(step, x_axis, y_axis,
+        filter, normalize)``, where ``step`` identifies the feedback results
+        object of the step (i.e., lines are not shared between steps of
+        different experiment logs).  Lines of steps that remain selected are
+        reused and only updated (using ``set_data``) if the plot settings
+        changed, lines are only added for newly selected steps, and lines of
+        steps that are no longer selected are removed.
+
+        Line data are decimated to the current view (see
+        :meth:`_decimate_step_lines`), and re-decimated whenever the x-limits
+        change (e.g., on zoom or pan).
+
+        Parameters
+        ----------
+        plot_data : list
+            ``(step_key, key, series, results)`` for each selected step,
+            where ``series`` is the return value of :meth:`_time_series`, or
+            ``None`` if the cached lines of the step already match ``key``.
+
+        Returns
+        -------
+        list
+            Export columns of each step.
+
+        .. versionadded:: 2.4.0
+        '''
+        import matplotlib.colors
+
+        columns = []
+        for step_key, key, series, results in plot_data:
+            entry = self._step_lines.get(step_key)
+            if entry is None:
+                line = self.axis.plot([], [])[0]
+                c = matplotlib.colors.colorConverter.to_rgba(line.get_c(),
+                                                             alpha=.2)
+                raw_line = self.axis.plot([], [], color=c)[0]
+                # Keep a reference to the results, so the `id` in the step key
+                # is not reused while the lines are cached.
+                entry = {'key': None, 'lines': (line, raw_line),
+                         'data': (None, None), 'columns': [],
+                         'results': results}
+                self._step_lines[step_key] = entry
+            if series is not None:
+                x, y, raw, columns_i = series
+                entry['lines'][1].set_visible(raw is not None)
+                entry['data'] = ((x, y), raw)
+                entry['key'] = key
+                entry['columns'] = columns_i
+            columns.append(entry['columns'])
+
+        # Remove lines of steps that are no longer selected.
+        selected = set(step_key for step_key, key, series, results in
+                       plot_data)
+        for step_key in set(self._step_lines) - selected:
+            for line in self._step_lines.pop(step_key)['lines']:
+                line.remove()
+        # Decimate across the full x-range (which preserves the extents of
+        # each line) to compute the data limits, then re-decimate for the
+        # view.
+        self._decimate_step_lines((-np.inf, np.inf))
+        self.axis.relim()
+        self.axis.autoscale_view()
+        self._decimate_step_lines()
+        return columns
+
     @gtk_threadsafe
     def update_plot(self):
         '''
         .. versionchanged:: 2.3.3
             Wrap with :func:`gtk_threadsafe` decorator to ensure the code runs
             in the main GTK thread.
+
+        .. versionchanged:: 2.4.0
+            Only collect plot settings and selected results here.  Plot data
+            are prepared in a background thread (see :meth:`_prepare_plot`)
+            and then applied to the plot in the main GTK thread (see
+            :meth:`_apply_plot`).  Preparation of a previous update that has
+            not completed yet is cancelled.
         '''
-        x_axis = combobox_get_active_text(self.combobox_x_axis)
-        y_axis = combobox_get_active_text(self.combobox_y_axis)
-        self.axis.cla()
-        self.axis.grid(True)
-        legend = []
-        legend_loc = "upper right"
-        self.export_data = []
+        settings = {'x_axis': combobox_get_active_text(self.combobox_x_axis),
+                    'y_axis': combobox_get_active_text(self.combobox_y_axis),
+                    'normalize':
+                    self.checkbutton_normalize_by_area.get_active(),
+                    'filter': self.checkbutton_filter.get_active()}
+        x_axis = settings['x_axis']
         experiment_log_controller = get_service_instance_by_name(
             "microdrop.gui.experiment_log_controller", "microdrop")
         protocol = experiment_log_controller.results.protocol
         dmf_device = experiment_log_controller.results.dmf_device
 
+        # Extract electrode states from protocol step.
+        def _get_actuated_area(protocol, row):
+            area = 0
+
+            plugin_data = (protocol[row['core']["step"]]
+                           .get_data('microdrop.electrode_controller_plugin'))
+
+            if 'electrode_states' in plugin_data:
+                electrode_states = plugin_data['electrode_states']
+
+                # Compute area of actuated electrodes.
+                area = dmf_device.get_actuated_electrodes_area(electrode_states)
+
+            return area
+
+        if x_axis == "Time":
+            results_name = "FeedbackResults"
+        else:
+            results_name = "FeedbackResultsSeries"
+
+        steps = []
+        for row in self.data:
+            if not (self.plugin.name in row.keys() and results_name in
+                    row[self.plugin.name].keys()):
+                continue
+            results = row[self.plugin.name][results_name]
+
+            if x_axis != "Time" and results.xlabel != x_axis:
+                continue
+
+            # results.area was not set in old versions of the software,
+            # so this is necessary for backwards compatibility
+            results.area = _get_actuated_area(protocol, row)
+
+            if settings['normalize'] and results.area == 0:
+                continue
+            steps.append((row['core']["step"], row['core']["time"], results))
+
+        if x_axis == "Time" and self._plot_x_axis == "Time":
+            line_keys = dict((step_key, entry['key']) for step_key, entry in
+                             self._step_lines.iteritems())
+        else:
+            line_keys = {}
+
+        self._plot_generation += 1
+        with self._plot_condition:
+            self._plot_request = (self._plot_generation, settings, steps,
+                                  line_keys)
+            self._plot_condition.notify()
+        if self._plot_thread is None:
+            self._plot_thread = threading.Thread(target=self._plot_worker,
+                                                 name='feedback-plot')
+            self._plot_thread.daemon = True
+            self._plot_thread.start()
+
+    def _plot_worker(self):
+        '''
+        Prepare plot data for the latest plot update request (see
+        :meth:`_prepare_plot`), one request at a time.
+
+        Executed in a background thread.
+
+        .. versionadded:: 2.4.0
+        '''
+        while True:
+            with self._plot_condition:
+                while self._plot_request is None:
+                    self._plot_condition.wait()
+                request = self._plot_request
+                self._plot_request = None
+            self._prepare_plot(*request)
+
+    def _prepare_plot(self, generation, settings, steps, line_keys):
+        '''
+        Compute plot data (e.g., filtered and normalized values, errorbar
+        statistics) for each step.
+
+        **MUST** be executed in a background thread.  Stops early (without
+        applying the plot) if the plot was updated again (i.e., the plot
+        generation changed) before completion.
+
+        .. versionadded:: 2.4.0
+        '''
+        x_axis = settings['x_axis']
+        y_axis = settings['y_axis']
+        normalization_string = "/mm$^2$" if settings['normalize'] else ""
+        plot_data = []
+        try:
+            for step, time_, results in steps:
+                if generation != self._plot_generation:
+                    # Stale render.
+                    return
+                normalization = (results.area if settings['normalize'] else
+                                 1.0)
+                if x_axis == "Time":
+                    step_key = (step, time_, id(results))
+                    key = (step_key, x_axis, y_axis, settings['filter'],
+                           settings['normalize'])
+                    if line_keys.get(step_key) == key:
+                        series = None
+                    else:
+                        series = self._time_series(results, y_axis,
+                                                   settings['filter'],
+                                                   normalization,
+                                                   normalization_string)
+                    plot_data.append((step_key, key, series, results))
+                else:
+                    plot_data.append(self._sweep_series(results, x_axis,
+                                                        y_axis,
+                                                        normalization,
+                                                        normalization_string))
+        except Exception:
+            logger.error('Error preparing feedback results plot.',
+                         exc_info=True)
+            return
+        self._apply_plot(generation, settings, steps, plot_data)
+
+    @gtk_threadsafe
+    def _apply_plot(self, generation, settings, steps, plot_data):
+        '''
+        Update plot with data prepared by :meth:`_prepare_plot`.
+
+        .. versionadded:: 2.4.0
+        '''
+        if generation != self._plot_generation:
+            # Plot was updated again since data were prepared.
+            return
+
+        x_axis = settings['x_axis']
+        y_axis = settings['y_axis']
+        if x_axis != "Time" or self._plot_x_axis != "Time":
+            # Lines for each step are only reused for "Time" plots.
+            self._clear_plot()
+        self._plot_x_axis = x_axis
+        self.axis.grid(True)
+        self.axis.set_yscale('linear')
+        legend = []
+        legend_loc = "upper right"
+
         normalization_string = ""
-        if self.checkbutton_normalize_by_area.get_active():
+        if settings['normalize']:
             normalization_string = "/mm$^2$"
 
         if y_axis == "Impedance":
@@ -1279,315 +1808,37 @@ class FeedbackResultsController():
             self.axis.set_title("x-position")
             self.axis.set_ylabel("x-position (mm)")
 
-        # Extract electrode states from protocol step.
-        def _get_actuated_area(protocol, row):
-            area = 0
-
-            plugin_data = (protocol[row['core']["step"]]
-                           .get_data('microdrop.electrode_controller_plugin'))
-
-            if 'electrode_states' in plugin_data:
-                electrode_states = plugin_data['electrode_states']
-
-                # Compute area of actuated electrodes.
-                area = dmf_device.get_actuated_electrodes_area(electrode_states)
-
-            return area
-
         handles = []
         if x_axis == "Time":
             self.axis.set_xlabel("Time (ms)")
-            for row in self.data:
-                if (self.plugin.name in row.keys() and "FeedbackResults" in
-                        row[self.plugin.name].keys()):
-                    results = row[self.plugin.name]["FeedbackResults"]
-
-                    # results.area was not set in old versions of the software,
-                    # so this is necessary for backwards compatibility
-                    results.area = _get_actuated_area(protocol, row)
-
-                    normalization = 1.0
-                    if self.checkbutton_normalize_by_area.get_active():
-                        if results.area == 0:
-                            continue
-                        else:
-                            normalization = results.area
-
-                    self.export_data.append('step:, %d' % (row['core']["step"]
-                                                           + 1))
-                    self.export_data.append('step time (s):, %f' %
-                                            (row['core']["time"]))
-
-                    # Only plot values that have a valid fb and hv resistor,
-                    # and that have been using the same fb and hv resistor for
-                    # > 1 consecutive measurement
-                    ind = mlab.find(np.logical_and(
-                        np.logical_and(results.fb_resistor != -1,
-                                       results.hv_resistor != -1),
-                        np.logical_and(
-                            np.concatenate(([0], np.diff(results.fb_resistor)))
-                            == 0,
-                            np.concatenate(([0], np.diff(results.hv_resistor)))
-                            == 0)))
-
-                    if y_axis == "Impedance":
-                        Z = results.Z_device()
-                        if self.checkbutton_filter.get_active():
-                            lines = self.axis.plot(results.time,
-                                                   results
-                                                   .Z_device(filter_order=3) /
-                                                   normalization)
-                            c = matplotlib.colors.colorConverter.to_rgba(
-                                lines[0].get_c(), alpha=.2)
-                            handles.append(lines[0])
-                            self.axis.plot(results.time, Z / normalization,
-                                           color=c)
-                        else:
-                            self.axis.plot(results.time, Z / normalization)
-                        self.export_data.append('time (ms):, ' +
-                                                ", ".join([str(x) for x in
-                                                           results.time]))
-                        self.export_data.append('impedance (Ohms%s):, ' %
-                                                (normalization_string) +
-                                                ", ".join([str(x) for x in
-                                                           Z / normalization]))
-                    elif y_axis == "Capacitance":
-                        C = results.capacitance()
-                        if self.checkbutton_filter.get_active():
-                            C_filtered = results.capacitance(filter_order=2)
-                            lines = self.axis.plot(results.time, C_filtered /
-                                                   normalization)
-                            handles.append(lines[0])
-                            c = matplotlib.colors.colorConverter.to_rgba(
-                                lines[0].get_c(), alpha=.2)
-                            self.axis.plot(results.time, C / normalization,
-                                           color=c)
-                        else:
-                            self.axis.plot(results.time, C / normalization)
-                        self.export_data.append('time (ms):, ' +
-                                                ", ".join([str(x) for x in
-                                                           results.time]))
-                        self.export_data.append('capacitance (F%s):,' %
-                                                normalization_string +
-                                                ", ".join([str(x) for x in
-                                                           C / normalization]))
-                    elif y_axis == "Velocity":
-                        if self.checkbutton_filter.get_active():
-                            t, dxdt = results.dxdt(filter_order=3)
-                            lines = self.axis.plot(t, dxdt * 1000)
-                            handles.append(lines[0])
-
-                            # plot the unfiltered (raw) velocity in the same
-                            # color, but a lighter shade
-                            c = matplotlib.colors.colorConverter.to_rgba(
-                                lines[0].get_c(), alpha=.2)
-                            t, raw_dxdt = results.dxdt()
-                            self.axis.plot(t, raw_dxdt * 1000, color=c)
-                        else:
-                            t, dxdt = results.dxdt()
-                            self.axis.plot(t, dxdt * 1000)
-                        self.export_data.append('time (ms):, ' +
-                                                ", ".join([str(x) for x in t]))
-                        self.export_data.append('velocity (mm/s):,' +
-                                                ", ".join([str(1e3 * x) for x in
-                                                           dxdt]))
-                    elif y_axis == "Voltage":
-                        self.axis.plot(results.time[ind],
-                                       results.V_actuation()[ind])
-                        self.export_data.append('time (ms):, ' +
-                                                ", ".join([str(x) for x in
-                                                           results.time[ind]]))
-                        self.export_data.append('V_actuation (V_RMS):,' +
-                                                ", ".join([str(x) for x in
-                                                           results
-                                                           .V_actuation()
-                                                           [ind]]))
-                    elif y_axis == "x-position":
-                        x_pos = results.x_position()
-                        if self.checkbutton_filter.get_active():
-                            lines = self.axis.plot(results.time,
-                                                   results
-                                                   .x_position(filter_order=3))
-                            handles.append(lines[0])
-                            c = matplotlib.colors.colorConverter.to_rgba(
-                                lines[0].get_c(), alpha=.2)
-                            self.axis.plot(results.time, x_pos, color=c)
-                        else:
-                            self.axis.plot(results.time, x_pos)
-                        self.export_data.append('time (ms):, ' +
-                                                ", ".join([str(x) for x in
-                                                           results.time]))
-                        self.export_data.append('x-position (mm):,' +
-                                                ", ".join([str(x) for x in
-                                                           x_pos]))
-                    legend.append("Step %d (%.3f s)" % (row['core']["step"] +
-                                                        1,
-                                                        row['core']["time"]))
-        elif x_axis == "Frequency":
-            self.axis.set_xlabel("Frequency (Hz)")
-            self.axis.set_xscale('log')
-            for row in self.data:
-                if (self.plugin.name in row.keys() and "FeedbackResultsSeries"
-                        in row[self.plugin.name].keys()):
-                    results = row[self.plugin.name]["FeedbackResultsSeries"]
-
-                    if results.xlabel != "Frequency":
-                        continue
-
-                    # results.area was not set in old versions of the software,
-                    # so this is necessary for backwards compatibility
-                    results.area = _get_actuated_area(protocol, row)
-
-                    normalization = 1.0
-                    if self.checkbutton_normalize_by_area.get_active():
-                        if results.area == 0:
-                            continue
-                        else:
-                            normalization = results.area
-
-                    self.export_data.append('step:, %d' %
-                                            (row['core']["step"] + 1))
-                    self.export_data.append('step time (s):, %f' %
-                                            (row['core']["time"]))
-                    self.export_data.append('frequency (Hz):, ' +
-                                            ", ".join([str(x) for x in
-                                                       results.frequency]))
-                    if y_axis == "Impedance":
-                        Z = np.ma.masked_invalid(results.Z_device())
-                        self.axis.errorbar(results.frequency,
-                                           np.mean(Z, 1) /
-                                           normalization,
-                                           np.std(Z, 1) /
-                                           normalization, fmt='.')
-                        self.export_data.append('mean(impedance) (Ohms%s):, ' %
-                                                normalization_string +
-                                                ", ".join([str(x) for x in
-                                                           np.mean(Z, 1) /
-                                                           normalization]))
-                        self.export_data.append('std(impedance) (Ohms%s):, ' %
-                                                normalization_string +
-                                                ", ".join([str(x) for x in
-                                                           np.std(Z, 1) /
-                                                           normalization]))
-                    elif y_axis == "Capacitance":
-                        C = np.ma.masked_invalid(results.capacitance())
-                        self.axis.errorbar(results.frequency,
-                                           np.mean(C, 1) /
-                                           normalization,
-                                           np.std(C, 1) /
-                                           normalization, fmt='.')
-                        self.export_data.append('mean(capacitance) (F):, ' +
-                                                ", "
-                                                .join([str(x) for x in
-                                                       np.mean(C /
-                                                               normalization,
-                                                               1)]))
-                        self.export_data.append('std(capacitance/area) (F):, '
-                                                + ", "
-                                                .join([str(x) for x in
-                                                       np.std(C, 1) /
-                                                       normalization]))
-                    elif y_axis == "Voltage":
-                        V = np.ma.masked_invalid(results.V_actuation())
-                        self.axis.errorbar(results.frequency,
-                                           np.mean(V, 1),
-                                           np.std(V, 1),
-                                           fmt='.')
-                        self.export_data.append('mean(V_actuation) (Vrms):, ' +
-                                                ", "
-                                                .join([str(x) for x in
-                                                       np.mean(V, 1)]))
-                        self.export_data.append('std(V_actuation) (Vrms):, ' +
-                                                ", "
-                                                .join([str(x) for x in
-                                                       np.std(V, 1)]))
-                    legend.append("Step %d (%.3f s)" % (row['core']["step"] +
-                                                        1,
-                                                        row['core']["time"]))
-        elif x_axis == "Voltage":
-            self.axis.set_xlabel("Actuation Voltage (V$_{RMS}$)")
-            for row in self.data:
-                if (self.plugin.name in row.keys() and "FeedbackResultsSeries"
-                        in row[self.plugin.name].keys()):
-                    results = row[self.plugin.name]["FeedbackResultsSeries"]
-
-                    if results.xlabel != "Voltage":
-                        continue
-
-                    # results.area was not set in old versions of the software,
-                    # so this is necessary for backwards compatibility
-                    results.area = _get_actuated_area(protocol, row)
-
-                    normalization = 1.0
-                    if self.checkbutton_normalize_by_area.get_active():
-                        if results.area == 0:
-                            continue
-                        else:
-                            normalization = results.area
-
-                    self.export_data.append('step:, %d' %
-                                            (row['core']["step"] + 1))
-                    self.export_data.append('step time (s):, %f' %
-                                            (row['core']["time"]))
-                    self.export_data.append('voltage (Vrms):, ' +
-                                            ", ".join([str(x) for x in
-                                                       results.voltage]))
-                    if y_axis == "Impedance":
-                        Z = np.ma.masked_invalid(results.Z_device())
-                        self.axis.errorbar(results.voltage,
-                                           np.mean(Z, 1) /
-                                           normalization,
-                                           np.std(Z, 1) /
-                                           normalization, fmt='.')
-                        self.export_data.append('mean(impedance) (Ohms%s):, ' %
-                                                normalization_string +
-                                                ", ".join([str(x) for x in
-                                                           np.mean(Z, 1) /
-                                                           normalization]))
-                        self.export_data.append('std(impedance) (Ohms%s):, '
-                                                % normalization_string +
-                                                ", ".join([str(x) for x in
-                                                           np.std(Z, 1) /
-                                                           normalization]))
-                    elif y_axis == "Capacitance":
-                        C = np.ma.masked_invalid(results.capacitance())
-                        self.axis.errorbar(results.voltage,
-                                           np.mean(C, 1) /
-                                           normalization,
-                                           np.std(C, 1) /
-                                           normalization, fmt='.')
-                        self.export_data.append('mean(capacitance) (F):, ' +
-                                                ", "
-                                                .join([str(x) for x in
-                                                       np.mean(C, 1) /
-                                                       normalization]))
-                        self.export_data.append('std(capacitance) (F):, ' +
-                                                ", "
-                                                .join([str(x) for x in
-                                                       np.std(C, 1) /
-                                                       normalization]))
-                    elif y_axis == "Voltage":
-                        V = np.ma.masked_invalid(results.V_actuation())
-                        self.axis.errorbar(results.voltage,
-                                           np.mean(V, 1),
-                                           np.std(V, 1),
-                                           fmt='.')
-                        self.export_data.append('mean(V_actuation) (Vrms):, ' +
-                                                ", "
-                                                .join([str(x) for x in
-                                                       np.mean(V, 1)]))
-                        self.export_data.append('std(V_actuation) (Vrms):, ' +
-                                                ", "
-                                                .join([str(x) for x in
-                                                       np.std(V, 1)]))
-                    legend.append("Step %d (%.3f s)" % (row['core']["step"] +
-                                                        1,
-                                                        row['core']["time"]))
+            columns = self._update_step_lines(plot_data)
+            handles = [self._step_lines[step_key]['lines'][0]
+                       for step_key, key, series, results in plot_data]
+        else:
+            if x_axis == "Frequency":
+                self.axis.set_xlabel("Frequency (Hz)")
+                self.axis.set_xscale('log')
+            elif x_axis == "Voltage":
+                self.axis.set_xlabel("Actuation Voltage (V$_{RMS}$)")
+            columns = []
+            for x, y_mean, y_std, columns_i in plot_data:
+                self.axis.errorbar(x, y_mean, y_std, fmt='.')
+                columns.append(columns_i)
+
+        # Keep references to plotted data; export files are only generated
+        # on request (see `export_csv()` and `export_hdf()`).
+        self.export_data = []
+        for (step, time_, results), columns_i in zip(steps, columns):
+            self.export_data.append((step, time_, columns_i))
+            legend.append("Step %d (%.3f s)" % (step + 1, time_))
+
         if len(legend):
             if len(handles):
                 self.axis.legend(handles, legend, loc=legend_loc)
             else:
                 self.axis.legend(legend, loc=legend_loc)
+        else:
+            self.axis.legend_ = None
 
         self.figure.subplots_adjust(left=0.17, bottom=0.15)
         self.canvas.draw()
@@ -1692,6 +1943,12 @@ class FeedbackCalibrationController():
                                     log.experiment_id),
                                 'data')
         self.experiment_log_controller.results.log.save(filename)
+        # Step summary, derived quantities and plotted lines depend on
+        # calibration.
+        self.plugin.step_summary.reset()
+        self.plugin.derived_quantities.invalidate()
+        if self.plugin.feedback_results_controller is not None:
+            self.plugin.feedback_results_controller.invalidate_lines()
         emit_signal("on_experiment_log_selection_changed", [selected_data])
 
     @gtk_threadsafe
@@ -1839,6 +2096,12 @@ class FeedbackCalibrationController():
                                 str(self.experiment_log_controller.results
                                     .log.experiment_id), 'data')
         self.experiment_log_controller.results.log.save(filename)
+        # Step summary, derived quantities and plotted lines depend on
+        # calibration.
+        self.plugin.step_summary.reset()
+        self.plugin.derived_quantities.invalidate()
+        if self.plugin.feedback_results_controller is not None:
+            self.plugin.feedback_results_controller.invalidate_lines()
         emit_signal("on_experiment_log_selection_changed", [selected_data])
 
     def on_perform_calibration(self, widget, data=None):
@@ -1874,6 +2137,13 @@ class FeedbackCalibrationController():
             return
 
         try:
+            from dmf_control_board_firmware.calibrate.hv_attenuator import \
+                plot_feedback_params
+            from matplotlib.backends.backend_gtkagg import (
+                FigureCanvasGTKAgg as FigureCanvasGTK,
+                NavigationToolbar2GTKAgg as NavigationToolbar)
+            from matplotlib.figure import Figure
+
             hv_readings = pd.read_hdf(str(filename),
                                       '/feedback/reference/measurements')
             fitted_params = pd.read_hdf(str(filename),
@@ -1927,6 +2197,13 @@ class FeedbackCalibrationController():
             return
 
         try:
+            from dmf_control_board_firmware.calibrate.impedance_benchmarks \
+                import plot_stat_summary
+            from matplotlib.backends.backend_gtkagg import (
+                FigureCanvasGTKAgg as FigureCanvasGTK,
+                NavigationToolbar2GTKAgg as NavigationToolbar)
+            from matplotlib.figure import Figure
+
             measurements = pd.read_hdf(str(filename),
                                        '/feedback/impedance/measurements')
 
@@ -1955,9 +2232,13 @@ class FeedbackCalibrationController():
             Wrap with :func:`gtk_threadsafe` decorator to ensure the code runs
             in the main GTK thread.
         '''
+        from .wizards import MicrodropReferenceAssistantView
+
         calibrations_dir = self.plugin.calibrations_dir()
         configurations_dir = self.plugin.configurations_dir()
         prefix = self.plugin._file_prefix()
+        # The wizard switches channels directly.
+        self.plugin.channel_writes.invalidate()
         view = MicrodropReferenceAssistantView(self.plugin.control_board)
 
         def on_calibrated(assistant):
@@ -1969,6 +2250,7 @@ class FeedbackCalibrationController():
         # Save the persistent configuration settings from the control-board to
         # a file upon successful calibration.
         view.widget.connect('close', on_calibrated)
+        view.widget.connect('close', self.plugin._on_wizard_close)
         view.show()
 
     @gtk_threadsafe
@@ -1978,9 +2260,13 @@ class FeedbackCalibrationController():
             Wrap with :func:`gtk_threadsafe` decorator to ensure the code runs
             in the main GTK thread.
         '''
+        from .wizards import MicrodropImpedanceAssistantView
+
         calibrations_dir = self.plugin.calibrations_dir()
         configurations_dir = self.plugin.configurations_dir()
         prefix = self.plugin._file_prefix()
+        # The wizard switches channels directly.
+        self.plugin.channel_writes.invalidate()
         view = MicrodropImpedanceAssistantView(self.plugin.control_board)
 
         def on_calibrated(assistant):
@@ -1992,4 +2278,5 @@ class FeedbackCalibrationController():
         # Save the persistent configuration settings from the control-board to
         # a file upon successful calibration.
         view.widget.connect('close', on_calibrated)
+        view.widget.connect('close', self.plugin._on_wizard_close)
         view.show()
@@ -0,0 +1,657 @@
+"""
+Copyright 2017 Ryan Fobel and Christian Fobel
+
+This file is part of dmf_control_board.
+
+dmf_control_board is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+dmf_control_board is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with dmf_control_board.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from functools import wraps
+import Queue
+import sys
+import threading
+
+from pygtkhelpers.gthreads import gtk_threadsafe
+import gtk
+import numpy as np
+
+
+class ChannelStates(object):
+    '''
+    Fixed-size buffer of requested channel states.
+
+    Parameters
+    ----------
+    channel_count : int, optional
+        Number of channels.
+
+    Attributes
+    ----------
+    states : numpy.ndarray
+        State of each channel (as ``numpy.uint8``).
+    dirty : bool
+        ``True`` if the states have changed since they were last applied to
+        the control board.
+
+    .. versionadded:: 2.4.0
+    '''
+    def __init__(self, channel_count=0):
+        self.states = np.zeros(channel_count, dtype=np.uint8)
+        self.dirty = True
+
+    def __len__(self):
+        return self.states.size
+
+    def resize(self, channel_count):
+        '''
+        Resize buffer to the specified number of channels.
+
+        States of existing channels are preserved and added channels default
+        to off.
+        '''
+        if channel_count == self.states.size:
+            return
+        states = np.zeros(channel_count, dtype=np.uint8)
+        shared_count = min(channel_count, self.states.size)
+        states[:shared_count] = self.states[:shared_count]
+        self.states = states
+        self.dirty = True
+
+    def update(self, channels, values, reset=False):
+        '''
+        Set the state of the specified channels in-place.
+
+        Parameters
+        ----------
+        channels : array-like
+            Channel numbers.
+        values : array-like
+            State of each channel in :data:`channels`.
+        reset : bool, optional
+            If ``True``, turn off all channels not listed in :data:`channels`.
+
+        Returns
+        -------
+        bool
+            ``True`` if the state of any channel changed.
+        '''
+        channels = np.asarray(channels, dtype=int)
+        values = np.asarray(values).astype(np.uint8)
+        if channels.size and channels.max() >= self.states.size:
+            self.resize(channels.max() + 1)
+        if reset:
+            states = np.zeros_like(self.states)
+            states[channels] = values
+            changed = not np.array_equal(states, self.states)
+            if changed:
+                self.states = states
+        else:
+            changed = (self.states[channels] != values).any()
+            if changed:
+                self.states[channels] = values
+        if changed:
+            self.dirty = True
+        return bool(changed)
+
+    def to_array(self, channel_count):
+        '''
+        Parameters
+        ----------
+        channel_count : int
+            Number of channels on the control board.
+
+        Returns
+        -------
+        numpy.ndarray
+            State of each of the first :data:`channel_count` channels (as
+            ``int``), where channels beyond the size of the buffer default to
+            off.
+        '''
+        channel_states = np.zeros(channel_count, dtype=int)
+        shared_count = min(channel_count, self.states.size)
+        channel_states[:shared_count] = self.states[:shared_count]
+        return channel_states
+
+
+class ChannelWriteCache(object):
+    '''
+    Shadow copy of the channel states most recently written to the control
+    board.
+
+    Attributes
+    ----------
+    states : numpy.ndarray or None
+        Channel states most recently written to the control board, or
+        ``None`` if the state of the hardware is unknown (e.g., after
+        connecting or after a measurement).
+    issued_count : int
+        Number of channel state writes issued to the control board.
+    skipped_count : int
+        Number of channel state writes skipped since the requested states
+        matched the shadow copy.
+
+    .. versionadded:: 2.4.0
+    '''
+    def __init__(self):
+        self.states = None
+        self.issued_count = 0
+        self.skipped_count = 0
+
+    def invalidate(self):
+        '''
+        Mark the state of the hardware as unknown, forcing the next write.
+        '''
+        self.states = None
+
+    def needs_write(self, states):
+        '''
+        Returns
+        -------
+        bool
+            ``False`` if :data:`states` matches the states most recently
+            written to the control board (the skipped write is counted).
+        '''
+        states = np.asarray(states, dtype=np.uint8)
+        if self.states is not None and np.array_equal(states, self.states):
+            self.skipped_count += 1
+            return False
+        return True
+
+    def record(self, states):
+        '''
+        Record states written to the control board.
+        '''
+        self.states = np.array(states, dtype=np.uint8)
+        self.issued_count += 1
+
+    def counts(self):
+        '''
+        Returns
+        -------
+        dict
+            Number of ``issued`` and ``skipped`` channel state writes.
+        '''
+        return {'issued': self.issued_count, 'skipped': self.skipped_count}
+
+
+class WaveformState(object):
+    '''
+    Waveform voltage and frequency most recently applied to the control
+    board.
+
+    Parameters
+    ----------
+    rtol, atol : float, optional
+        Relative and absolute tolerance used to decide whether a requested
+        value matches the applied value.
+
+    Attributes
+    ----------
+    voltage, frequency : float or None
+        Applied value, or ``None`` if unknown (e.g., after connecting).
+
+    .. versionadded:: 2.4.0
+    '''
+    def __init__(self, rtol=1e-6, atol=1e-6):
+        self.rtol = rtol
+        self.atol = atol
+        self.voltage = None
+        self.frequency = None
+
+    def invalidate(self):
+        '''
+        Mark the applied voltage and frequency as unknown.
+        '''
+        self.voltage = None
+        self.frequency = None
+
+    def _matches(self, applied, value):
+        return applied is not None and (abs(value - applied) <=
+                                        self.atol + self.rtol * abs(applied))
+
+    def voltage_matches(self, voltage):
+        return self._matches(self.voltage, voltage)
+
+    def frequency_matches(self, frequency):
+        return self._matches(self.frequency, frequency)
+
+
+class AmplifierGainCache(object):
+    '''
+    Amplifier gain learned for each waveform frequency (and, optionally,
+    actuated area).
+
+    Parameters
+    ----------
+    area_bucket_mm2 : float, optional
+        If set, gains are also keyed by actuated area, rounded to the nearest
+        multiple of :data:`area_bucket_mm2`.
+
+    .. versionadded:: 2.4.0
+    '''
+    def __init__(self, area_bucket_mm2=None):
+        self.area_bucket_mm2 = area_bucket_mm2
+        self._gains = {}
+
+    def __len__(self):
+        return len(self._gains)
+
+    def _key(self, frequency, area):
+        # Round frequency to the nearest mHz to avoid floating point noise.
+        key = (round(frequency, 3), )
+        if self.area_bucket_mm2:
+            key += (int(round(area / self.area_bucket_mm2)), )
+        return key
+
+    def get(self, frequency, area=0):
+        '''
+        Returns
+        -------
+        float or None
+            Amplifier gain learned for the specified frequency and area, or
+            ``None`` if no gain has been learned.
+        '''
+        return self._gains.get(self._key(frequency, area))
+
+    def set(self, frequency, area, gain):
+        self._gains[self._key(frequency, area)] = gain
+
+    def clear(self):
+        self._gains.clear()
+
+
+class DeviceInfo(object):
+    '''
+    Snapshot of control board identity, captured once per connection to
+    avoid querying the control board for values that do not change while
+    connected.
+
+    .. versionadded:: 2.4.0
+    '''
+    def __init__(self, name, hardware_version, software_version,
+                 number_of_channels, serial_number):
+        self.name = name
+        self.hardware_version = hardware_version
+        self.software_version = software_version
+        self.number_of_channels = number_of_channels
+        self.serial_number = serial_number
+
+    @classmethod
+    def from_control_board(cls, control_board):
+        '''
+        Query identity of a connected control board.
+
+        Parameters
+        ----------
+        control_board : dmf_control_board_firmware.DMFControlBoard
+        '''
+        return cls(control_board.name(), control_board.hardware_version(),
+                   control_board.software_version(),
+                   control_board.number_of_channels(),
+                   control_board.serial_number)
+
+
+class HardwareRequestCancelled(Exception):
+    pass
+
+
+class HardwareFuture(object):
+    '''
+    Result of a request submitted to a :class:`HardwareWorker`.
+
+    .. versionadded:: 2.4.0
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._state = 'pending'
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def cancel(self):
+        '''
+        Cancel the request, unless it is already running or done.
+
+        Returns
+        -------
+        bool
+            ``True`` if the request was cancelled.
+        '''
+        with self._lock:
+            if self._state == 'cancelled':
+                return True
+            elif self._state != 'pending':
+                return False
+            self._state = 'cancelled'
+            self._exc_info = (HardwareRequestCancelled,
+                              HardwareRequestCancelled('Request cancelled.'),
+                              None)
+        self._finish()
+        return True
+
+    def cancelled(self):
+        return self._state == 'cancelled'
+
+    def running(self):
+        return self._state == 'running'
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        '''
+        Wait for the request to complete and return its result.
+
+        Raises
+        ------
+        HardwareRequestCancelled
+            If the request was cancelled.
+        RuntimeError
+            If the request did not complete within :data:`timeout` seconds.
+
+        Any exception raised by the request is re-raised.
+        '''
+        self._event.wait(timeout)
+        if not self.done():
+            raise RuntimeError('Timed out waiting for hardware request.')
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        '''
+        Returns
+        -------
+        Exception or None
+            Exception raised by the (completed) request, if any.
+        '''
+        if self._exc_info is not None:
+            return self._exc_info[1]
+
+    def add_done_callback(self, callback):
+        '''
+        Call :data:`callback` with the future as its only argument once the
+        request completes (or is cancelled).
+
+        The callback is always called in the main GTK thread.
+        '''
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        gtk_threadsafe(callback)(self)
+
+    def _set_running(self):
+        with self._lock:
+            if self._state != 'pending':
+                return False
+            self._state = 'running'
+            return True
+
+    def _set_result(self, result):
+        with self._lock:
+            self._result = result
+            self._state = 'done'
+        self._finish()
+
+    def _set_exc_info(self, exc_info):
+        with self._lock:
+            self._exc_info = exc_info
+            self._state = 'done'
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._event.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            gtk_threadsafe(callback)(self)
+
+
+class HardwareWorker(threading.Thread):
+    '''
+    Thread that owns all serial I/O to the control board.
+
+    Requests are executed one at a time, in the order they were submitted.
+
+    .. versionadded:: 2.4.0
+    '''
+    def __init__(self):
+        super(HardwareWorker, self).__init__(name='control-board')
+        self.daemon = True
+        self._requests = Queue.Queue()
+        self._lock = threading.Lock()
+        # Number of submitted requests that have not completed.
+        self._outstanding = 0
+        # Called once all submitted requests have completed (see
+        # `add_idle_callback()`).
+        self._idle_callbacks = []
+
+    def run(self):
+        while True:
+            future, func, args, kwargs = self._requests.get()
+            exc_info = None
+            result = None
+            running = future._set_running()
+            if running:
+                try:
+                    result = func(*args, **kwargs)
+                except Exception:
+                    exc_info = sys.exc_info()
+            # Request is no longer outstanding *before* the result is set, so
+            # a caller waiting for the result never finds the worker busy
+            # with its own request.
+            with self._lock:
+                self._outstanding -= 1
+                if self._outstanding:
+                    idle_callbacks = []
+                else:
+                    idle_callbacks = self._idle_callbacks
+                    self._idle_callbacks = []
+            if running:
+                if exc_info is not None:
+                    future._set_exc_info(exc_info)
+                else:
+                    future._set_result(result)
+            exc_info = None
+            for callback in idle_callbacks:
+                gtk_threadsafe(callback)()
+
+    def busy(self):
+        '''
+        Returns
+        -------
+        bool
+            ``True`` if any submitted request has not completed.
+        '''
+        return self._outstanding > 0
+
+    def add_idle_callback(self, callback):
+        '''
+        Call :data:`callback` (without arguments) once all submitted requests
+        have completed, i.e., once the worker is no longer :meth:`busy`.
+
+        The callback is always called in the main GTK thread.
+        '''
+        with self._lock:
+            if self._outstanding:
+                self._idle_callbacks.append(callback)
+                return
+        gtk_threadsafe(callback)()
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Queue a call to :data:`func` to be executed in the worker thread.
+
+        Returns
+        -------
+        HardwareFuture
+            Result of the call.
+        '''
+        future = HardwareFuture()
+        with self._lock:
+            self._outstanding += 1
+        self._requests.put((future, func, args, kwargs))
+        return future
+
+    def call(self, func, *args, **kwargs):
+        '''
+        Execute :data:`func` in the worker thread and wait for the result.
+
+        If called from the worker thread, :data:`func` is executed directly.
+        '''
+        if threading.current_thread() is self:
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+
+class ControlBoardProxy(object):
+    '''
+    Proxy to a control board, where method calls and property accesses that
+    may perform serial I/O are executed by a :class:`HardwareWorker`.
+
+    Plain instance attributes are read directly, and the values of
+    :attr:`cached_attributes` are cached, such that reading them does not
+    wait for the worker (e.g., during a long measurement).
+
+    Parameters
+    ----------
+    control_board : dmf_control_board_firmware.DMFControlBoard
+    worker : HardwareWorker
+
+    .. versionadded:: 2.4.0
+    '''
+    # Methods that do not perform serial I/O and may be called from any
+    # thread.
+    local_methods = ('connected', 'host_url', 'host_software_version')
+    # Attributes that only change when set through the proxy, or when the
+    # control board is (re)connected or its configuration is rewritten (see
+    # `invalidate_cache()`).
+    cached_attributes = ('calibration', 'auto_adjust_amplifier_gain',
+                         'voltage_tolerance')
+
+    def __init__(self, control_board, worker):
+        object.__setattr__(self, '_control_board', control_board)
+        object.__setattr__(self, '_worker', worker)
+        object.__setattr__(self, '_cache', {})
+
+    def invalidate_cache(self):
+        '''
+        Discard cached attribute values, e.g., after connecting or after
+        writing the configuration of the control board.
+        '''
+        self._cache.clear()
+
+    def __getattr__(self, name):
+        control_board = self._control_board
+        if name in self.cached_attributes:
+            cache = self._cache
+            if name not in cache:
+                cache[name] = self._worker.call(getattr, control_board, name)
+            return cache[name]
+
+        class_attr = getattr(type(control_board), name, None)
+        if class_attr is None:
+            # Instance attribute (no serial I/O).
+            return getattr(control_board, name)
+        elif isinstance(class_attr, property):
+            # Property (may perform serial I/O).
+            return self._worker.call(getattr, control_board, name)
+        elif not callable(class_attr):
+            # Class constant (e.g., `MAX_PAYLOAD_LENGTH`).
+            return class_attr
+
+        method = getattr(control_board, name)
+        if name in self.local_methods:
+            return method
+
+        @wraps(method)
+        def _call(*args, **kwargs):
+            return self._worker.call(method, *args, **kwargs)
+        return _call
+
+    def __setattr__(self, name, value):
+        control_board = self._control_board
+        if isinstance(getattr(type(control_board), name, None), property):
+            self._worker.call(setattr, control_board, name, value)
+        else:
+            setattr(control_board, name, value)
+        if name in self.cached_attributes:
+            self._cache[name] = value
+
+
+def probe_ports(ports, probe):
+    '''
+    Probe serial ports concurrently, each in its own thread.
+
+    Parameters
+    ----------
+    ports : list
+        Serial ports to probe.
+    probe : function
+        Called as ``probe(port)`` in the thread for each port.  **MUST** not
+        share a serial connection with any other thread (e.g., must use its
+        own control board instance).
+
+    Returns
+    -------
+    list
+        :class:`HardwareFuture` with result of :data:`probe` for each port (in
+        the same order as :data:`ports`).
+
+    .. versionadded:: 2.4.0
+    '''
+    futures = []
+    for port in ports:
+        future = HardwareFuture()
+
+        def _probe(port=port, future=future):
+            future._set_running()
+            try:
+                result = probe(port)
+            except Exception:
+                future._set_exc_info(sys.exc_info())
+            else:
+                future._set_result(result)
+        thread = threading.Thread(target=_probe, name='probe-%s' % port)
+        thread.daemon = True
+        thread.start()
+        futures.append(future)
+    return futures
+
+
+def gtk_wait(future):
+    '''
+    Wait for a request to complete, while continuing to process GTK events.
+
+    **MUST** be called from the main GTK thread.
+
+    Note that GTK event handlers (e.g., timeouts) may run while waiting, so
+    the caller is responsible for deferring handlers that must not be
+    re-entered.
+
+    Returns
+    -------
+    object
+        Result of the request (see :meth:`HardwareFuture.result`).
+
+    .. versionadded:: 2.4.0
+    '''
+    # Callbacks are scheduled in the GTK main loop, which wakes up the loop
+    # when the request completes.
+    future.add_done_callback(lambda future: None)
+    while not future.done():
+        gtk.main_iteration(True)
+    return future.result()
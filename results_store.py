@@ -0,0 +1,521 @@
+"""
+Copyright 2017 Ryan Fobel and Christian Fobel
+
+This file is part of dmf_control_board.
+
+dmf_control_board is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+dmf_control_board is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with dmf_control_board.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from collections import OrderedDict
+import threading
+import types
+import weakref
+
+from path_helpers import path
+import numpy as np
+import pandas as pd
+
+
+#: Suffix of columns holding the mask of a masked array attribute.
+MASK_SUFFIX = '__mask'
+
+
+class _EmptyClass:
+    # Used to instantiate old-style classes without calling `__init__` (same
+    # approach as `pickle`).
+    pass
+
+
+def _instantiate(cls):
+    if isinstance(cls, types.ClassType):
+        obj = _EmptyClass()
+        obj.__class__ = cls
+        return obj
+    return cls.__new__(cls)
+
+
+def split_feedback_results(feedback_results):
+    '''
+    Split feedback results into per-sample columns and remaining attributes.
+
+    Parameters
+    ----------
+    feedback_results : dmf_control_board_firmware.FeedbackResults
+        Feedback results.
+
+    Returns
+    -------
+    (dict, dict, list)
+        Tuple containing:
+
+         - Per-sample arrays (i.e., 1D arrays with one value per entry in
+           ``time``), indexed by attribute name.  The mask of each masked
+           array is included as a separate column (named by appending
+           :data:`MASK_SUFFIX` to the attribute name).
+         - All other attributes (e.g., ``calibration``, ``area``,
+           ``frequency``), indexed by attribute name.
+         - Names of masked array attributes.
+    '''
+    sample_count = len(feedback_results.time)
+    columns = {}
+    attributes = {}
+    masked = []
+    for name, value in feedback_results.__dict__.iteritems():
+        if (isinstance(value, np.ndarray) and value.ndim == 1 and
+                value.shape[0] == sample_count):
+            if isinstance(value, np.ma.MaskedArray):
+                columns[name + MASK_SUFFIX] = np.ma.getmaskarray(value)
+                masked.append(name)
+            columns[name] = np.ma.getdata(value)
+        else:
+            attributes[name] = value
+    return columns, attributes, masked
+
+
+class FeedbackResultsStore(object):
+    '''
+    Append-only store of per-sample feedback results columns, with one record
+    for each call to :meth:`append`.
+
+    Subclasses implement :meth:`write_columns`, :meth:`read_columns` and
+    :meth:`__contains__`.
+
+    Parameters
+    ----------
+    base_dir : str
+        Experiment log directory.
+    name : str
+        Path of the store, relative to :data:`base_dir`.
+
+    Only :data:`name` is pickled (e.g., with the :class:`FeedbackResultsRef`
+    instances in an experiment log), so the store remains valid if the
+    experiment log directory is moved or copied.  The base directory of an
+    unpickled store **MUST** be set (see :func:`bind_feedback_results`)
+    before the store is accessed.
+    '''
+    def __init__(self, base_dir, name):
+        self.base_dir = path(base_dir).abspath()
+        self.name = path(name)
+
+    @property
+    def root(self):
+        '''
+        Absolute path of the store.
+        '''
+        if self.base_dir is None:
+            raise ValueError('Base directory of %r is not set (see '
+                             '`bind_feedback_results()`).' % self)
+        return self.base_dir.joinpath(self.name)
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (self.__class__.__name__,
+                               self.base_dir and str(self.base_dir),
+                               str(self.name))
+
+    def __getstate__(self):
+        return {'name': str(self.name)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.name = path(self.name)
+        self.base_dir = None
+
+    def append(self, step_index, feedback_results):
+        '''
+        Append feedback results to the store.
+
+        Parameters
+        ----------
+        step_index : int
+            Experiment log step index.
+        feedback_results : dmf_control_board_firmware.FeedbackResults
+            Feedback results.
+
+        Returns
+        -------
+        FeedbackResultsRef
+            Lightweight reference to the stored feedback results, suitable
+            for adding to the experiment log in place of
+            :data:`feedback_results`.
+        '''
+        columns, attributes, masked = split_feedback_results(feedback_results)
+        attempt = 0
+        while self.record_key(step_index, attempt) in self:
+            attempt += 1
+        key = self.record_key(step_index, attempt)
+        self.write_columns(key, columns)
+        return FeedbackResultsRef(self, key, feedback_results.__class__,
+                                  attributes, masked)
+
+    def record_key(self, step_index, attempt):
+        return 'step%05d_%d' % (step_index, attempt)
+
+    def __contains__(self, key):
+        raise NotImplementedError
+
+    def write_columns(self, key, columns):
+        raise NotImplementedError
+
+    def read_columns(self, key, names=None):
+        '''
+        Parameters
+        ----------
+        key : str
+            Record key.
+        names : list, optional
+            Names of columns to read (all columns by default).
+
+        Returns
+        -------
+        dict
+            Column arrays, indexed by column name.
+        '''
+        raise NotImplementedError
+
+
+class HdfFeedbackResultsStore(FeedbackResultsStore):
+    '''
+    Feedback results store backed by a HDF5 file, with one table per record.
+
+    Records are only read from disk when requested, and reads may be limited
+    to a subset of columns.
+
+    Record keys are read from the file once and then maintained in memory,
+    so checking for a record does not open the file.
+    '''
+    def _hdf_store(self, mode='r'):
+        return pd.HDFStore(str(self.root), mode=mode)
+
+    def _record_keys(self):
+        # Record keys, read from the file the first time the store is
+        # accessed at its current path (see `bind_feedback_results()`).
+        root = self.root
+        root_keys = self.__dict__.get('_root_keys')
+        if root_keys is None or root_keys[0] != root:
+            keys = set()
+            if root.isfile():
+                with self._hdf_store() as store:
+                    keys.update(key.lstrip('/') for key in store.keys())
+            root_keys = self._root_keys = (root, keys)
+        return root_keys[1]
+
+    def __contains__(self, key):
+        return key in self._record_keys()
+
+    def write_columns(self, key, columns):
+        self.root.parent.makedirs_p()
+        keys = self._record_keys()
+        with self._hdf_store(mode='a') as store:
+            store.put(key, pd.DataFrame(columns), format='table')
+        keys.add(key)
+
+    def read_columns(self, key, names=None):
+        with self._hdf_store() as store:
+            df = store.select(key, columns=names)
+        return dict((name, df[name].values) for name in df.columns)
+
+
+class NpyFeedbackResultsStore(FeedbackResultsStore):
+    '''
+    Feedback results store backed by a directory of NumPy ``.npy`` files,
+    with one sub-directory per record and one file per column.
+
+    Columns are memory-mapped (read-only) when read, so loading feedback
+    results for many steps (e.g., to plot them) only reads the samples that
+    are actually accessed.
+    '''
+    def __contains__(self, key):
+        return self.root.joinpath(key).isdir()
+
+    def write_columns(self, key, columns):
+        record_dir = self.root.joinpath(key)
+        record_dir.makedirs_p()
+        for name, values in columns.iteritems():
+            np.save(record_dir.joinpath(name + '.npy'), values)
+
+    def read_columns(self, key, names=None):
+        record_dir = self.root.joinpath(key)
+        if names is None:
+            names = [npy_path.namebase for npy_path in
+                     record_dir.files('*.npy')]
+        return dict((name, np.load(record_dir.joinpath(name + '.npy'),
+                                   mmap_mode='r'))
+                    for name in names)
+
+
+class FeedbackResultsRef(object):
+    '''
+    Lightweight (i.e., picklable without per-sample data) reference to
+    feedback results in a :class:`FeedbackResultsStore`.
+
+    Attributes other than per-sample arrays (e.g., ``calibration``, ``area``,
+    ``frequency``) are held by the reference and may be read or modified
+    without loading the feedback results.  Any other attribute access (e.g.,
+    ``capacitance()``, ``to_frame()``) is delegated to the feedback results
+    loaded from the store.
+
+    Loaded feedback results are *not* kept by the reference.  Instead, the
+    most recently accessed feedback results (up to :attr:`max_loaded`, shared
+    by all references) are cached, so memory use does not grow with the
+    number of references accessed (e.g., when plotting every step of an
+    experiment).  Code that reads every step once (e.g., exports) should use
+    :meth:`load` (or :func:`load_feedback_results`), which bypasses the
+    cache.
+    '''
+    _ref_attributes = ('_store', '_key', '_results_class', '_attributes',
+                       '_masked')
+    #: Maximum number of loaded feedback results cached (see :meth:`cached`).
+    max_loaded = 8
+    _loaded = OrderedDict()
+    _loaded_lock = threading.Lock()
+
+    def __init__(self, store, key, results_class, attributes, masked):
+        self.__dict__.update(_store=store, _key=key,
+                             _results_class=results_class,
+                             _attributes=dict(attributes),
+                             _masked=list(masked))
+
+    def __repr__(self):
+        return '<%s %r in %r>' % (self.__class__.__name__, self._key,
+                                  self._store)
+
+    def __getstate__(self):
+        return dict((name, self.__dict__[name])
+                    for name in self._ref_attributes)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        attributes = self.__dict__.get('_attributes', {})
+        if name in attributes:
+            return attributes[name]
+        return getattr(self.cached(), name)
+
+    def __setattr__(self, name, value):
+        self._attributes[name] = value
+        with self._loaded_lock:
+            results = self._loaded.get(self._cache_key())
+        if results is not None:
+            setattr(results, name, value)
+
+    def _cache_key(self):
+        return (str(self._store.root), self._key)
+
+    def cached(self):
+        '''
+        Returns
+        -------
+        dmf_control_board_firmware.FeedbackResults
+            Feedback results, loaded from the store unless they are among the
+            :attr:`max_loaded` most recently accessed feedback results.
+        '''
+        cache_key = self._cache_key()
+        with self._loaded_lock:
+            results = self._loaded.pop(cache_key, None)
+            if results is not None:
+                self._loaded[cache_key] = results
+                return results
+        results = self.load()
+        with self._loaded_lock:
+            self._loaded[cache_key] = results
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return results
+
+    def release(self):
+        '''
+        Discard cached feedback results (see :meth:`cached`), if any.
+        '''
+        with self._loaded_lock:
+            self._loaded.pop(self._cache_key(), None)
+
+    def load(self):
+        '''
+        Returns
+        -------
+        dmf_control_board_firmware.FeedbackResults
+            Feedback results, loaded from the store (not cached).
+        '''
+        columns = self._store.read_columns(self._key)
+        state = {}
+        for name, values in columns.iteritems():
+            if name.endswith(MASK_SUFFIX):
+                continue
+            if name in self._masked:
+                values = np.ma.masked_array(values,
+                                            mask=columns[name + MASK_SUFFIX])
+            state[name] = values
+        state.update(self._attributes)
+        results = _instantiate(self._results_class)
+        if hasattr(results, '__setstate__'):
+            results.__setstate__(state)
+        else:
+            results.__dict__.update(state)
+        return results
+
+
+def bind_feedback_results(results, base_dir):
+    '''
+    Set the base directory of the stores referred to by feedback results
+    references, e.g., after loading an experiment log (see
+    :class:`FeedbackResultsStore`).
+
+    Parameters
+    ----------
+    results : list
+        Feedback results, references to feedback results, or ``None`` (e.g.,
+        for each step of an experiment log).
+    base_dir : str
+        Experiment log directory.
+    '''
+    base_dir = path(base_dir).abspath()
+    for results_i in results:
+        if isinstance(results_i, FeedbackResultsRef):
+            results_i._store.base_dir = base_dir
+
+
+def load_feedback_results(results):
+    '''
+    Parameters
+    ----------
+    results : dmf_control_board_firmware.FeedbackResults or FeedbackResultsRef
+        Feedback results (or reference to feedback results).
+
+    Returns
+    -------
+    dmf_control_board_firmware.FeedbackResults
+        :data:`results` if not a reference.  Otherwise, feedback results
+        loaded from the store *without* caching them (see
+        :meth:`FeedbackResultsRef.load`), e.g., to read the results of each
+        step of an experiment once.
+    '''
+    if isinstance(results, FeedbackResultsRef):
+        return results.load()
+    return results
+
+
+class DerivedQuantityCache(object):
+    '''
+    Bounded (least-recently-used) cache of quantities derived from feedback
+    results, e.g., ``Z_device()``, ``capacitance(filter_order=2)``,
+    ``dxdt(filter_order=3)``.
+
+    Cached values are keyed by feedback results object, calibration revision
+    (see :meth:`invalidate`), calibration object, area, method name, and
+    method keyword arguments.
+
+    Feedback results objects are only referenced weakly, i.e., the cache does
+    not keep feedback results alive, and the cached values of feedback
+    results are discarded once the feedback results are garbage collected.
+
+    The cache may be shared between threads (e.g., the GTK thread and a
+    plot preparation thread).
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        Maximum number of cached values.
+    '''
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.revision = 0
+        self._entries = OrderedDict()
+        # Weak reference to each feedback results object with cached values,
+        # indexed by `id`.
+        self._refs = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self):
+        '''
+        Discard all cached values, e.g., after a calibration was modified in
+        place.
+        '''
+        with self._lock:
+            self.revision += 1
+            self._entries.clear()
+            self._refs.clear()
+
+    def _discard(self, results_id):
+        # Discard cached values of feedback results (e.g., once garbage
+        # collected, since the `id` may then be reused).
+        with self._lock:
+            self._refs.pop(results_id, None)
+            for key in [key for key in self._entries
+                        if key[0] == results_id]:
+                del self._entries[key]
+
+    def _on_collected(self, ref, results_id):
+        with self._lock:
+            if self._refs.get(results_id) is ref:
+                self._discard(results_id)
+
+    def get(self, results, name, **kwargs):
+        '''
+        Parameters
+        ----------
+        results : dmf_control_board_firmware.FeedbackResults
+            Feedback results (or reference to feedback results).
+        name : str
+            Name of feedback results method (e.g., ``"capacitance"``).
+        **kwargs
+            Keyword arguments to method (e.g., ``filter_order=2``).
+
+        Returns
+        -------
+        object
+            Return value of ``results.<name>(**kwargs)``, computed on first
+            access.
+        '''
+        results_id = id(results)
+        with self._lock:
+            ref = self._refs.get(results_id)
+            if ref is None or ref() is not results:
+                if ref is not None:
+                    # `id` of collected feedback results was reused.
+                    self._discard(results_id)
+                cache_ref = weakref.ref(self)
+
+                def on_collected(collected_ref):
+                    cache = cache_ref()
+                    if cache is not None:
+                        cache._on_collected(collected_ref, results_id)
+                ref = weakref.ref(results, on_collected)
+                self._refs[results_id] = ref
+            key = (results_id, self.revision,
+                   id(getattr(results, 'calibration', None)),
+                   getattr(results, 'area', None), name,
+                   tuple(sorted(kwargs.iteritems())))
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+                return value
+
+        # Compute value *without* holding the lock to avoid blocking other
+        # threads (e.g., the GTK thread) during the computation.
+        value = getattr(results, name)(**kwargs)
+
+        with self._lock:
+            if (key[1] == self.revision and
+                    self._refs.get(results_id) is ref):
+                # Cache is still valid for the feedback results (i.e., not
+                # invalidated and feedback results not discarded).
+                while len(self._entries) >= self.max_entries:
+                    self._entries.popitem(last=False)
+                self._entries[key] = value
+        return value